@@ -1,77 +1,311 @@
 # app.py
 import os
+import importlib
 import time
-import math
 import re
 import logging
+import secrets
+import stat
 import subprocess
 import shutil
 import sys
 from pathlib import Path
+from urllib.parse import quote
 from shutil import copyfile
 from datetime import datetime
 from functools import wraps
-from io import BytesIO
 
 from flask import (
     Flask, render_template, request, send_file, jsonify, abort,
-    url_for, redirect, session, flash
+    url_for, redirect, session, flash, Response, g
 )
-from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import secure_filename, send_file as send_file_offloaded
 
-from docx import Document
-from num2words import num2words
-
-# TOTP & QR
-import pyotp
-import qrcode
-
-# Optional docx2pdf (we import dynamically inside try to avoid startup failure)
-# Optional Windows COM init/uninit
-try:
-    import pythoncom
-    import pywintypes
-except Exception:
-    pythoncom = None
-    pywintypes = None
+from batch import (
+    BatchError, parse_batch, validate_rows, allocate_invoice_numbers, iter_batch_zip
+)
+from invoices import (
+    DOCX_MIMETYPE, ENGINE_NAMES, build_replacements, invoice_number, month_year_for, render_docx, render_pdf,
+    pdf_filename, docx_filename as invoice_docx_filename
+)
+from file_etags import FileETags
+from invoice_registry import InvoiceRegistry
+from metrics import METRICS
+from conversion_jobs import ConversionJobs, RUNNING, DONE, FAILED
+from pdf_convert import ConversionError, ConversionPool
+from profiling import KINDS as PROFILE_KINDS, RequestProfiler
+from qr_cache import MIMETYPES as QR_MIMETYPES, QrCache
+from render_cache import RenderCache
+from suffix_allocator import SuffixAllocator, SuffixTaken
+from sessions import RedisSessionStore, ServerSessionInterface, SqliteSessionStore
+from template_registry import TemplateRegistry
+from totp_guard import RATE_LIMITED, REPLAYED, TotpGuard, OK as TOTP_OK, INVALID as TOTP_INVALID
+from totp_store import TotpSecretStore
+from zipstream import ZipStream, iter_file
+
+# Heavy modules are imported by the code that needs them: python-docx on
+# the first render, pyotp on login/setup, qrcode (and PIL) only for the
+# setup QR code. A cold start or a new worker only pays for Flask.
+# APP_PRELOAD=1 imports them up front instead, e.g. before a pre-fork server
+# forks so the workers share the pages.
+HEAVY_MODULES = ("docx", "lxml.etree", "pyotp", "qrcode", "PIL.Image")
+
+def preload_heavy_modules():
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+if os.environ.get("APP_PRELOAD") == "1":
+    preload_heavy_modules()
 
 # ---------- Config ----------
-# If APP_SECRET env var is NOT provided, we generate a random secret at startup.
-# That will invalidate cookies after every restart (forces TOTP again).
+# If APP_SECRET env var is NOT provided, see SESSION_BACKEND below.
 APP_SECRET = os.environ.get("APP_SECRET")
-if not APP_SECRET:
-    # random secret each start -> forces login after restart
-    APP_SECRET = os.urandom(32).hex()
 
 TOTP_SECRET_FILE = Path("auth_totp_secret.txt")
+# In memory with its verifier; the file is re-checked at most once a second
+TOTP_STORE = TotpSecretStore(TOTP_SECRET_FILE)
+# Every code is accepted once, and a client address gets TOTP_MAX_FAILURES
+# wrong codes per TOTP_LOCKOUT seconds. TOTP_MAX_FAILURES_TOTAL > 0 adds a
+# limit for everyone together; it is off by default because anyone can use
+# it up and lock the admin out. Shared by the workers through small files in
+# TOTP_STATE_DIR (/dev/shm by default). Behind a reverse proxy set
+# TRUSTED_PROXIES (below), or every client has the proxy's address and the
+# per-client limit becomes a global one.
+TOTP_MAX_FAILURES = int(os.environ.get("TOTP_MAX_FAILURES", 5))
+TOTP_GUARD = TotpGuard(os.environ.get("TOTP_STATE_DIR"), valid_window=1,
+                       max_failures=TOTP_MAX_FAILURES,
+                       max_failures_total=int(os.environ.get("TOTP_MAX_FAILURES_TOTAL", 0)),
+                       lockout=int(os.environ.get("TOTP_LOCKOUT", 300)))
 UPLOAD_TEMPLATE = "uploads/template.docx"
 OUTPUT_DIR = "output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+OUTPUT_ROOT = str(Path(OUTPUT_DIR).resolve())
+
+# In its own directory: SQLite creates and deletes the -wal/-shm files next
+# to the database, and every one of those would change OUTPUT_DIR's mtime and
+# make the registry below rescan the archive.
+INDEX_DIR = os.path.join(OUTPUT_DIR, ".index")
+os.makedirs(INDEX_DIR, exist_ok=True)
+INVOICE_INDEX_DB = os.environ.get("INVOICE_INDEX_DB", os.path.join(INDEX_DIR, "invoice_index.sqlite3"))
+
+# Per-month GB-MMYY-NN counters with reservations, stored in the index
+# database. Counters only move up, so rebuilding from filenames is always safe.
+SUFFIX_ALLOCATOR = SuffixAllocator(INVOICE_INDEX_DB)
+SUFFIX_ALLOCATOR.rebuild_from_directory(OUTPUT_DIR)
+
+# SQLite index of the PDFs in OUTPUT_DIR, reconciled with the directory at
+# startup and whenever its mtime changes. PDFs that show up there also move
+# the suffix counters.
+INVOICE_REGISTRY = InvoiceRegistry(OUTPUT_DIR, INVOICE_INDEX_DB, on_added=SUFFIX_ALLOCATOR.rebuild_from_filenames)
+INVOICE_REGISTRY.reconcile()
+INVOICES_PER_PAGE = int(os.environ.get("INVOICES_PER_PAGE", 100))
+
+# Rendered DOCX/PDF bytes keyed by template version and replacements, so an
+# identical regeneration is a file read. RENDER_CACHE_MAX_MB=0 turns it off.
+RENDER_CACHE_MAX_MB = float(os.environ.get("RENDER_CACHE_MAX_MB", 256))
+RENDER_CACHE = None
+if RENDER_CACHE_MAX_MB > 0:
+    RENDER_CACHE = RenderCache(os.environ.get("RENDER_CACHE_DIR", os.path.join(OUTPUT_DIR, ".render_cache")),
+                               int(RENDER_CACHE_MAX_MB * 1024 * 1024))
+
+# Placeholder substitution engine: "lxml" edits w:p/w:r/w:t elements directly,
+# "docx" goes through python-docx Run objects (both produce the same DOCX);
+# "xml" patches the serialised XML parts and never builds a Document.
+RENDER_ENGINE = os.environ.get("INVOICE_RENDER_ENGINE", "lxml")
+if RENDER_ENGINE not in ENGINE_NAMES:
+    raise RuntimeError(f"Unknown INVOICE_RENDER_ENGINE {RENDER_ENGINE!r}; expected one of {ENGINE_NAMES}")
+
+# Render processes for /generate-batch; 0 renders in the request thread.
+BATCH_WORKERS = int(os.environ.get("INVOICE_BATCH_WORKERS", os.cpu_count() or 1))
+
+# How the PDF next to each saved DOCX is made: "office" converts the DOCX in
+# the background through a pool of long-lived headless LibreOffice workers,
+# started on first use; "native" draws it directly from the template
+# (pdf_render.py) while the request is served.
+PDF_RENDERER = os.environ.get("INVOICE_PDF_RENDERER", "office")
+if PDF_RENDERER not in ("office", "native"):
+    raise RuntimeError(f"Unknown INVOICE_PDF_RENDERER {PDF_RENDERER!r}; expected 'office' or 'native'")
+
+# Every version of uploads/template.docx, kept by content hash in
+# TEMPLATE_VERSIONS_DIR (default uploads/.versions). The first version is
+# loaded on first use (serve.py loads it in the master, before forking), so
+# importing the app stays light. After that a watcher thread polls the file
+# every TEMPLATE_POLL_SECONDS (0 = never) and parses, compiles and checks a
+# new version before it becomes active, so requests never wait for a
+# changed template. The version each invoice was made from is recorded, and
+# /generate can render with it again (template_version=original).
+def prepare_template(cache):
+    if RENDER_ENGINE == "xml":
+        cache.stencil()
+    if PDF_RENDERER == "native":
+        cache.pdf_layout()
+
+TEMPLATES = TemplateRegistry(
+    UPLOAD_TEMPLATE,
+    os.environ.get("TEMPLATE_VERSIONS_DIR", os.path.join(os.path.dirname(UPLOAD_TEMPLATE), ".versions")),
+    INVOICE_INDEX_DB,
+    expected=build_replacements(0, "2000-01-01", "", "", "").keys(),
+    poll_interval=float(os.environ.get("TEMPLATE_POLL_SECONDS", 2)),
+    warm=prepare_template,
+)
+
+# PDF_CONVERT_WORKERS=0 turns conversion off; so does soffice not being found.
+# The pool belongs to the process: under serve.py every web worker has its
+# own, so up to --workers x PDF_CONVERT_WORKERS soffice processes run.
+PDF_CONVERT_WORKERS = int(os.environ.get("PDF_CONVERT_WORKERS", 2)) if PDF_RENDERER == "office" else 0
+PDF_CONVERT_TIMEOUT = float(os.environ.get("PDF_CONVERT_TIMEOUT", 60))
+PDF_CONVERT_RECYCLE_AFTER = int(os.environ.get("PDF_CONVERT_RECYCLE_AFTER", 200))
+PDF_CONVERTER = None
+if PDF_CONVERT_WORKERS > 0:
+    try:
+        PDF_CONVERTER = ConversionPool(
+            size=PDF_CONVERT_WORKERS,
+            timeout=PDF_CONVERT_TIMEOUT,
+            recycle_after=PDF_CONVERT_RECYCLE_AFTER,
+            soffice=os.environ.get("SOFFICE_BIN"),
+            python=os.environ.get("OFFICE_PYTHON"),
+        )
+    except ConversionError as e:
+        logging.getLogger(__name__).warning("PDF conversion disabled: %s", e)
+
+# Where sessions live. "cookie" (default) keeps Flask's signed cookies: with
+# no APP_SECRET a random secret is generated at startup, which invalidates
+# cookies after every restart (forces TOTP again) and differs between
+# processes that import the app separately. "sqlite" (one host) and "redis"
+# (REDIS_URL, several hosts) keep them server-side, so every worker sees a
+# login; without APP_SECRET the secret is created once in that store and
+# shared, and sessions survive restarts.
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "cookie")
+if SESSION_BACKEND == "sqlite":
+    SESSION_STORE = SqliteSessionStore(os.environ.get("SESSION_DB", os.path.join(INDEX_DIR, "sessions.sqlite3")))
+elif SESSION_BACKEND == "redis":
+    SESSION_STORE = RedisSessionStore.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+elif SESSION_BACKEND == "cookie":
+    SESSION_STORE = None
+else:
+    raise RuntimeError(f"Unknown SESSION_BACKEND {SESSION_BACKEND!r}; expected 'cookie', 'sqlite' or 'redis'")
+if not APP_SECRET:
+    # from the store; otherwise random each start -> forces login after restart
+    APP_SECRET = SESSION_STORE.shared_secret() if SESSION_STORE is not None else os.urandom(32).hex()
+
+# Setup QR codes, rendered once per secret. QR_FORMAT=svg has the setup page
+# use the SVG form, which skips PIL drawing and PNG encoding.
+QR_FORMAT = os.environ.get("QR_FORMAT", "png")
+if QR_FORMAT not in QR_MIMETYPES:
+    raise RuntimeError(f"Unknown QR_FORMAT {QR_FORMAT!r}; expected 'png' or 'svg'")
+QR_CACHE = QrCache()
+
+# Content-hash ETags for /download, recomputed only when a file changes
+DOWNLOAD_ETAGS = FileETags()
+
+# Who copies /download bytes: "none" streams the file from Python (through
+# the WSGI server's sendfile when it has one); "x-sendfile" hands the path
+# to Apache/lighttpd; "x-accel" hands DOWNLOAD_ACCEL_PREFIX + name to nginx,
+# which must map it to OUTPUT_DIR in an `internal` location. Either way the
+# front server does the Range handling.
+DOWNLOAD_OFFLOAD = os.environ.get("DOWNLOAD_OFFLOAD", "none")
+if DOWNLOAD_OFFLOAD not in ("none", "x-sendfile", "x-accel"):
+    raise RuntimeError(f"Unknown DOWNLOAD_OFFLOAD {DOWNLOAD_OFFLOAD!r}; expected 'none', 'x-sendfile' or 'x-accel'")
+DOWNLOAD_ACCEL_PREFIX = os.environ.get("DOWNLOAD_ACCEL_PREFIX", "/protected-output/")
+
+# Stage timings and counters for /metrics. Off by default; when off the
+# instrumentation is a flag check. The directory is where each worker
+# process leaves its numbers so that any of them can answer a scrape.
+# With METRICS_TOKEN set, /metrics wants "Authorization: Bearer <token>".
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED") == "1"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+METRICS.configure(METRICS_ENABLED, os.environ.get("METRICS_DIR", os.path.join(INDEX_DIR, "metrics")))
+
+# Logged-in users can profile one request by adding ?_profile=1 or an
+# "X-Profile: 1" header; the response names the profile in X-Profile-Id and
+# /profiles/<id>/<txt|pstats|collapsed> serves it. REQUEST_PROFILING=0
+# turns the flag off.
+REQUEST_PROFILING = os.environ.get("REQUEST_PROFILING", "1") == "1"
+PROFILER = RequestProfiler(os.environ.get("PROFILE_DIR", "profiles"), keep=int(os.environ.get("PROFILE_KEEP", 50)))
+
+# queued/running/done/failed per conversion, for /jobs/<id>. Jobs left
+# unfinished by a process that died are failed here and on lookup.
+CONVERSION_JOBS = ConversionJobs(INVOICE_INDEX_DB)
+if CONVERSION_JOBS.fail_orphaned():
+    logging.getLogger(__name__).warning("Marked PDF conversions of exited workers as failed")
 
 app = Flask(__name__)
 app.secret_key = APP_SECRET
+# Number of reverse proxies (e.g. the nginx in front for DOWNLOAD_OFFLOAD)
+# whose X-Forwarded-For / -Proto entries are trusted. request.remote_addr is
+# then the real client, which the TOTP failure limit is keyed on. Leave at 0
+# when clients connect directly: the headers could be forged.
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+if SESSION_STORE is not None:
+    app.session_interface = ServerSessionInterface(SESSION_STORE)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+if METRICS_ENABLED:
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop("request_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "unknown"
+            METRICS.observe("http_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+            METRICS.inc("http_requests_total", endpoint=endpoint, status=response.status_code)
+        return response
+
+if REQUEST_PROFILING:
+    @app.before_request
+    def _start_profile():
+        wanted = request.args.get("_profile") == "1" or request.headers.get("X-Profile") == "1"
+        if wanted and session.get("authenticated"):
+            g.profile = PROFILER.start()
+            g.profile_busy = g.profile is None
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile_id = PROFILER.finish(profile, request.endpoint or "request")
+            response.headers["X-Profile-Id"] = profile_id
+            response.headers["X-Profile-Url"] = url_for("profile_file", profile_id=profile_id, kind="txt")
+        elif g.pop("profile_busy", False):
+            response.headers["X-Profile-Id"] = "busy"
+        return response
+
+    @app.teardown_request
+    def _abandon_profile(exc):
+        # the view raised: still stop the profiler and keep what it saw
+        profile = g.pop("profile", None)
+        if profile is not None:
+            PROFILER.finish(profile, f"{request.endpoint or 'request'}-error")
+
 # ---------- Auth helpers (passcode-only TOTP) ----------
 def get_totp_secret():
-    if TOTP_SECRET_FILE.exists():
-        return TOTP_SECRET_FILE.read_text().strip()
-    return None
+    return TOTP_STORE.get()
 
 def save_totp_secret(secret):
-    TOTP_SECRET_FILE.write_text(secret)
+    TOTP_STORE.save(secret)
 
 def generate_totp_uri(secret, issuer_name="GBUILDCON", account_name="GB-Admin"):
+    import pyotp
     return pyotp.totp.TOTP(secret).provisioning_uri(name=account_name, issuer_name=issuer_name)
 
-def verify_totp_code(secret, code):
-    try:
-        totp = pyotp.TOTP(secret)
-        return totp.verify(code, valid_window=1)  # allow ±1 step skew
-    except Exception:
-        return False
+def check_totp_code(secret, code, client=None):
+    # -> TOTP_OK, TOTP_INVALID, REPLAYED or RATE_LIMITED
+    with METRICS.stage("invoice_stage_seconds", operation="totp", stage="verify"):
+        totp = TOTP_STORE.verifier(secret)
+        result = TOTP_GUARD.check(totp, code, client) if totp is not None else TOTP_INVALID  # ±1 step skew
+    METRICS.inc("totp_verifications_total", result=result)
+    return result
+
+def verify_totp_code(secret, code, client=None):
+    return check_totp_code(secret, code, client) == TOTP_OK
 
 def login_required(f):
     @wraps(f)
@@ -81,126 +315,11 @@ def login_required(f):
         return f(*args, **kwargs)
     return wrapped
 
-# ---------- Number to words (Indian) ----------
-def number_to_words_indian(amount):
-    amount_str = "{:.2f}".format(float(amount))
-    rupees_str, paise_str = amount_str.split(".")
-    rupees = int(rupees_str)
-    paise = int(paise_str)
-    rupees_words = num2words(rupees, lang='en_IN').replace(",", "").title()
-    if paise > 0:
-        paise_words = num2words(paise, lang='en_IN').replace(",", "").title()
-        return f"{rupees_words} Rupees And {paise_words} Paise Only"
-    else:
-        return f"{rupees_words} Rupees Only"
-
-# ---------- Placeholder replacement & doc helpers ----------
-PLACEHOLDER_RE = re.compile(r'(\{\{[^}]+\}\})')
-
-BOLD_KEYS = {
-    "{{base_amo}}","{{cgst_c}}","{{sgst_c}}","{{tax_t}}","{{sub_total_words}}","{{tax_to_words}}"
-}
-BOLD_PARAGRAPH_KEYS = {"{{sub_total_words}}","{{tax_to_words}}","{{sub_total}}"}
-
-def replace_placeholders_in_paragraph(paragraph, replacements):
-    full_text = ''.join(run.text for run in paragraph.runs)
-    if "{{" not in full_text:
-        return
-    paragraph_should_be_bold = any(k in full_text for k in BOLD_PARAGRAPH_KEYS)
-    segments=[]
-    idx=0
-    found=False
-    for m in PLACEHOLDER_RE.finditer(full_text):
-        found=True
-        start,end=m.span()
-        placeholder=m.group(1)
-        if start>idx:
-            segments.append((full_text[idx:start], paragraph_should_be_bold))
-        replacement_text = replacements.get(placeholder, placeholder)
-        is_bold = paragraph_should_be_bold or (placeholder in BOLD_KEYS)
-        segments.append((replacement_text, is_bold))
-        idx=end
-    if idx < len(full_text):
-        segments.append((full_text[idx:], paragraph_should_be_bold))
-    if not found:
-        return
-    for r in paragraph.runs:
-        r.text=""
-    for text, bold_flag in segments:
-        if not text:
-            continue
-        r = paragraph.add_run(text)
-        if bold_flag:
-            r.bold=True
-
-def replace_placeholders_in_table(table, replacements):
-    for row in table.rows:
-        for cell in row.cells:
-            replace_placeholders_in_block(cell, replacements)
-
-def replace_placeholders_in_block(block, replacements):
-    if hasattr(block, "paragraphs"):
-        for p in list(block.paragraphs):
-            replace_placeholders_in_paragraph(p, replacements)
-    if hasattr(block, "tables"):
-        for t in block.tables:
-            replace_placeholders_in_table(t, replacements)
-
-def replace_placeholders_in_doc(doc, replacements):
-    replace_placeholders_in_block(doc, replacements)
-    for section in doc.sections:
-        try:
-            replace_placeholders_in_block(section.header, replacements)
-        except Exception:
-            pass
-        try:
-            replace_placeholders_in_block(section.footer, replacements)
-        except Exception:
-            pass
-
-def is_paragraph_empty(paragraph):
-    if paragraph.text and paragraph.text.strip():
-        return False
-    for run in paragraph.runs:
-        if run.text and run.text.strip():
-            return False
-    return True
-
-def remove_trailing_empty_paragraphs_from_block(block):
-    if not hasattr(block, "paragraphs"):
-        return
-    while block.paragraphs:
-        last = block.paragraphs[-1]
-        if is_paragraph_empty(last):
-            p_el = last._element
-            parent = p_el.getparent()
-            if parent is not None:
-                parent.remove(p_el)
-            else:
-                break
-        else:
-            break
-
-def remove_trailing_empty_paragraphs(doc):
-    remove_trailing_empty_paragraphs_from_block(doc)
-    for section in doc.sections:
-        try:
-            remove_trailing_empty_paragraphs_from_block(section.header)
-        except Exception:
-            pass
-        try:
-            remove_trailing_empty_paragraphs_from_block(section.footer)
-        except Exception:
-            pass
-
 # ---------- Invoice list & suffix (only PDFs) ----------
-def list_existing_invoices():
+def _invoice_entries(rows):
     invoices=[]
-    for p in sorted(Path(OUTPUT_DIR).glob("*.pdf"), reverse=True):
-        safe_name=p.name
+    for safe_name, invoice_no in rows:
         display_name=safe_name.replace("_"," ")
-        m=re.search(r"(GB-\d{4}-\d+)", safe_name)
-        invoice_no=m.group(1) if m else ""
         try:
             url=url_for("download_file", filename=safe_name)
         except RuntimeError:
@@ -208,20 +327,95 @@ def list_existing_invoices():
         invoices.append({"filename":safe_name,"display_name":display_name,"invoice_no":invoice_no,"url":url})
     return invoices
 
-def get_next_suffix_for_month(month_year):
-    max_suffix=0
-    pattern=re.compile(rf"GB-{re.escape(month_year)}-(\d+)")
-    for path in Path(OUTPUT_DIR).glob("*.pdf"):
-        name=path.stem
-        m=pattern.search(name)
-        if m:
-            try:
-                val=int(m.group(1))
-                if val>max_suffix:
-                    max_suffix=val
-            except Exception:
-                pass
-    return f"{max_suffix+1:02d}"
+def list_existing_invoices(offset=0, limit=None):
+    # Newest first, from the SQLite index rather than globbing OUTPUT_DIR
+    with METRICS.stage("invoice_stage_seconds", operation="list_invoices", stage="reconcile"):
+        INVOICE_REGISTRY.reconcile_if_changed()
+    with METRICS.stage("invoice_stage_seconds", operation="list_invoices", stage="query"):
+        rows = INVOICE_REGISTRY.page(offset, limit)
+    return _invoice_entries(rows)
+
+def list_invoices_for_month(month_year):
+    INVOICE_REGISTRY.reconcile_if_changed()
+    return _invoice_entries(INVOICE_REGISTRY.for_month(month_year))
+
+def allocation_holder():
+    # Identifies this browser session to the suffix allocator
+    holder = session.get("suffix_holder")
+    if not holder:
+        holder = session["suffix_holder"] = secrets.token_hex(8)
+    return holder
+
+def get_next_suffix_for_month(month_year, holder=None):
+    # With a holder the suffix is held for that session, so two users with
+    # the form open are offered different numbers.
+    if holder:
+        return f"{SUFFIX_ALLOCATOR.hold(month_year, holder):02d}"
+    return f"{SUFFIX_ALLOCATOR.suggest(month_year):02d}"
+
+# ---------- PDF conversion ----------
+def queue_pdf_conversion(docx_path, invoice_no=None):
+    # Convert a saved DOCX to the PDF of the same name in OUTPUT_DIR in the
+    # background; it is listed once the conversion finishes.
+    # -> job id for /jobs/<id>, or None when conversion is off.
+    if PDF_CONVERTER is None:
+        return None
+    pdf_path = os.path.join(OUTPUT_DIR, Path(docx_path).with_suffix(".pdf").name)
+    job_id = CONVERSION_JOBS.create(os.path.basename(docx_path), os.path.basename(pdf_path), invoice_no)
+
+    def started():
+        CONVERSION_JOBS.mark(job_id, RUNNING)
+
+    def converted(path):
+        INVOICE_REGISTRY.add(os.path.basename(path))
+        CONVERSION_JOBS.mark(job_id, DONE)
+        METRICS.inc("invoices_generated_total", format="pdf")
+        logger.info("Converted %s", path)
+
+    def finished(future):
+        if future.exception() is not None:
+            logger.error("PDF conversion of %s failed: %s", docx_path, future.exception())
+            METRICS.inc("errors_total", operation="pdf_convert")
+            CONVERSION_JOBS.mark(job_id, FAILED, str(future.exception()))
+
+    future = PDF_CONVERTER.submit(docx_path, pdf_path, on_done=converted, on_start=started)
+    future.add_done_callback(finished)
+    return job_id
+
+def write_invoice_pdf(docx_path, invoice_no, replacements, template):
+    # The PDF for a freshly saved DOCX made from `template` (a TemplateCache).
+    # -> conversion job id, or None when the PDF was drawn natively (or
+    # conversion is off).
+    if PDF_RENDERER != "native":
+        return queue_pdf_conversion(docx_path, invoice_no)
+    name = secure_filename(pdf_filename(invoice_no))
+    pdf_path = os.path.join(OUTPUT_DIR, name)
+    try:
+        data = render_pdf(template, replacements, RENDER_CACHE)
+        with METRICS.stage("invoice_stage_seconds", operation="generate", stage="save_pdf"):
+            Path(pdf_path + ".part").write_bytes(data)
+            os.replace(pdf_path + ".part", pdf_path)
+    except Exception as e:
+        METRICS.inc("errors_total", operation="render_pdf")
+        logger.exception("Failed to write PDF %s: %s", name, e)
+        return None
+    INVOICE_REGISTRY.add(name)
+    METRICS.inc("invoices_generated_total", format="pdf")
+    return None
+
+def batch_invoice_saved(template):
+    # on_saved for iter_batch_zip (/generate-batch and the batch.py CLI):
+    # what /generate does after saving a DOCX made from `template`
+    def saved(docx_path, invoice_no, replacements):
+        TEMPLATES.record(invoice_no, template.version)
+        return write_invoice_pdf(docx_path, invoice_no, replacements, template)
+    return saved
+
+def job_status(job):
+    status = {k: job[k] for k in ("id", "invoice_no", "status", "error")}
+    status["docx"] = job["docx"]
+    status["download_url"] = url_for("download_file", filename=job["pdf"]) if job["status"] == DONE else None
+    return status
 
 # ---------- Auth routes ----------
 @app.route("/setup-2fa", methods=["GET","POST"])
@@ -230,34 +424,39 @@ def setup_2fa():
     if request.method == "GET":
         if existing:
             return render_template("setup_2fa.html", already_setup=True)
-        secret = pyotp.random_base32()
-        session["setup_tmp_secret"] = secret
-        return render_template("setup_2fa.html", already_setup=False)
+        # Reloading the page keeps the secret (and so its cached QR code)
+        if not session.get("setup_tmp_secret"):
+            import pyotp
+            session["setup_tmp_secret"] = pyotp.random_base32()
+        return render_template("setup_2fa.html", already_setup=False, qr_url=url_for("setup_qr", fmt=QR_FORMAT))
     secret = session.get("setup_tmp_secret")
     if not secret:
         flash("No setup in progress. Reload page.", "danger")
         return redirect(url_for("setup_2fa"))
     code = (request.form.get("code") or "").strip()
-    if verify_totp_code(secret, code):
+    if verify_totp_code(secret, code, request.remote_addr):
         save_totp_secret(secret)
         session.pop("setup_tmp_secret", None)
+        QR_CACHE.discard(generate_totp_uri(secret))
         flash("TOTP configured. Now use the code on the login page.", "success")
         return redirect(url_for("login"))
     else:
         flash("Invalid code. Try again.", "danger")
         return redirect(url_for("setup_2fa"))
 
-@app.route("/setup-qr.png")
-def setup_qr_png():
+@app.route("/setup-qr.png", defaults={"fmt": "png"})
+@app.route("/setup-qr.svg", defaults={"fmt": "svg"})
+def setup_qr(fmt):
     secret = session.get("setup_tmp_secret")
     if not secret:
         abort(404)
-    uri = generate_totp_uri(secret)
-    img = qrcode.make(uri)
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    data, etag = QR_CACHE.get(generate_totp_uri(secret), fmt)
+    # The image embeds the secret: never in a shared cache, and revalidated
+    # (304) rather than reused once the setup secret changes
+    response = Response(data, mimetype=QR_MIMETYPES[fmt])
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
 
 @app.route("/login", methods=["GET","POST"])
 def login():
@@ -266,16 +465,25 @@ def login():
     if request.method == "GET":
         return render_template("login.html", totp_enabled=bool(totp_secret), next=next_url)
     code = (request.form.get("code") or "").strip()
-    secret = get_totp_secret()
+    secret = totp_secret
     if not secret:
         flash("TOTP not configured. Visit Setup 2FA.", "danger")
         return redirect(url_for("setup_2fa"))
     if not code:
         flash("Enter the 6-digit code", "danger")
         return redirect(url_for("login"))
-    if not verify_totp_code(secret, code):
+    result = check_totp_code(secret, code, request.remote_addr)
+    if result == RATE_LIMITED:
+        flash("Too many wrong passcodes. Try again in a few minutes.", "danger")
+        return redirect(url_for("login"))
+    if result == REPLAYED:
+        flash("That passcode was already used. Wait for the next one.", "danger")
+        return redirect(url_for("login"))
+    if result != TOTP_OK:
         flash("Invalid passcode", "danger")
         return redirect(url_for("login"))
+    if isinstance(app.session_interface, ServerSessionInterface):
+        app.session_interface.regenerate(session)
     session["authenticated"] = True
     flash("Authenticated", "success")
     return redirect(next_url)
@@ -292,12 +500,18 @@ def logout():
 def index():
     today = datetime.now().strftime("%Y-%m-%d")
     month_year = datetime.now().strftime("%m%y")
-    next_suffix = get_next_suffix_for_month(month_year)
-    invoices = list_existing_invoices()
+    next_suffix = get_next_suffix_for_month(month_year, allocation_holder())
+    page = max(request.args.get("page", 1, type=int), 1)
+    invoices = list_existing_invoices((page - 1) * INVOICES_PER_PAGE, INVOICES_PER_PAGE)
+    total = INVOICE_REGISTRY.count()
     return render_template("index.html",
                            default_date=today,
                            suggested_suffix=next_suffix,
-                           invoices=invoices)
+                           current_month=month_year,
+                           invoices=invoices,
+                           page=page,
+                           has_next=page * INVOICES_PER_PAGE < total,
+                           total_invoices=total)
 
 @app.route('/next-suffix')
 @login_required
@@ -309,7 +523,7 @@ def next_suffix():
         month_year = datetime.strptime(date_value, "%Y-%m-%d").strftime("%m%y")
     except Exception:
         return jsonify({"error":"invalid date"}),400
-    next_suffix = get_next_suffix_for_month(month_year)
+    next_suffix = get_next_suffix_for_month(month_year, allocation_holder())
     return jsonify({"next_suffix": next_suffix})
 
 @app.route('/generate', methods=['POST'])
@@ -320,7 +534,6 @@ def generate_invoice():
         y_value = float(request.form['y_value'])
     except Exception:
         return "Invalid y_value", 400
-    sub_total = math.ceil(y_value * 1.02)
 
     date_value = request.form.get('date', datetime.now().strftime("%Y-%m-%d"))
     invoice_suffix = request.form.get('invoice_suffix','').strip()
@@ -330,95 +543,227 @@ def generate_invoice():
     if not invoice_suffix.isdigit():
         return "Invoice suffix must be numeric", 400
 
-    date_formatted = datetime.strptime(date_value, "%Y-%m-%d").strftime("%d/%m/%Y")
-    month_year = datetime.strptime(date_value, "%Y-%m-%d").strftime("%m%y")
-    invoice_no = f"GB-{month_year}-{invoice_suffix}"
+    invoice_no = invoice_number(date_value, invoice_suffix)
 
-    base_amount = sub_total / 1.18
-    cgst = base_amount * 0.09
-    sgst = base_amount * 0.09
-    sub_total_2 = base_amount + cgst + sgst
-    tax_total = cgst + sgst
-
-    sub_total_words = number_to_words_indian(sub_total)
-    tax_total_words = number_to_words_indian(tax_total)
+    # The active template unless an earlier version is asked for, by hash or
+    # as "original" (the one this invoice number was first made from)
+    template_version = request.form.get('template_version', '').strip()
+    if template_version == "original":
+        template_version = TEMPLATES.version_for(invoice_no) or ""
+        if not template_version:
+            return f"No template version recorded for {invoice_no}", 404
+    try:
+        template = TEMPLATES.get(template_version) if template_version else TEMPLATES.active()
+    except Exception as e:
+        logger.exception("Failed to load template: %s", e)
+        return f"Failed to load template: {e}", 500
+    if template is None:
+        return f"Unknown template version {template_version}", 404
+    replacements = build_replacements(y_value, date_value, invoice_no, payment_type, hsn_code)
+
+    # Reserve the number so a concurrent request cannot generate it too
+    month_year = month_year_for(date_value)
+    holder = allocation_holder()
+    try:
+        with METRICS.stage("invoice_stage_seconds", operation="generate", stage="reserve"):
+            SUFFIX_ALLOCATOR.reserve(month_year, holder, int(invoice_suffix))
+    except SuffixTaken as e:
+        return f"Invoice number {invoice_no} is being generated by another user. Next free suffix: {e.next_suffix:02d}", 409
 
-    # Load template
     try:
-        doc = Document(UPLOAD_TEMPLATE)
+        data = render_docx(template, RENDER_ENGINE, replacements, RENDER_CACHE)
     except Exception as e:
-        logger.exception("Failed to open template: %s", e)
-        return f"Failed to open template: {e}", 500
-
-    replacements = {
-        "{{BASE_TOTAL}}": f"{base_amount:.2f}",
-        "{{BASE_TO}}": f"{base_amount:.2f}",
-        "{{SUB_TOTAL}}": f"{sub_total:.2f}",
-        "{{TAX_TO_C}}": f"{tax_total:.2f}",
-        "{{SGST_C}}": f"{sgst:.2f}",
-        "{{CGST_C}}": f"{cgst:.2f}",
-        "{{base_amount}}": f"{base_amount:.2f}",
-        "{{base_amo}}": f"{base_amount:.2f}",
-        "{{cgst}}": f"{cgst:.2f}",
-        "{{sgst}}": f"{sgst:.2f}",
-        "{{tax_to}}": f"{tax_total:.2f}",
-        "{{cgst_c}}": f"{cgst:.2f}",
-        "{{sgst_c}}": f"{sgst:.2f}",
-        "{{tax_t}}": f"{tax_total:.2f}",
-        "{{sub_total}}": f"{sub_total_2:.2f}",
-        "{{sub_total_words}}": sub_total_words,
-        "{{tax_to_words}}": tax_total_words,
-        "{{date}}": date_formatted,
-        "{{invoice_no}}": invoice_no,
-        "{{payment_type}}": payment_type,
-        "{{hsn}}": hsn_code,
-        "{{hsn_1}}": hsn_code,
-        "{{hsn_n}}": hsn_code,
-    }
-
-    replace_placeholders_in_doc(doc, replacements)
-    remove_trailing_empty_paragraphs(doc)
+        SUFFIX_ALLOCATOR.release(month_year, int(invoice_suffix), holder)
+        METRICS.inc("errors_total", operation="render_docx")
+        logger.exception("Failed to render invoice: %s", e)
+        return f"Failed to render invoice: {e}", 500
 
     # Save DOCX and send as download
-    timestamp = int(time.time())
-    docx_filename = f"G_BUILDCON_Invoice_{invoice_no}.docx"
+    docx_filename = invoice_docx_filename(invoice_no)
     safe_docx_filename = secure_filename(docx_filename)
     output_docx = os.path.join(OUTPUT_DIR, safe_docx_filename)
     try:
-        doc.save(output_docx)
+        with METRICS.stage("invoice_stage_seconds", operation="generate", stage="save_docx"):
+            Path(output_docx).write_bytes(data)
     except Exception as e:
+        SUFFIX_ALLOCATOR.release(month_year, int(invoice_suffix), holder)
+        METRICS.inc("errors_total", operation="save_docx")
         logger.exception("Failed to save DOCX: %s", e)
         return f"Failed to save docx: {e}", 500
+    SUFFIX_ALLOCATOR.commit(month_year, int(invoice_suffix))
+    TEMPLATES.record(invoice_no, template.version)
+    METRICS.inc("invoices_generated_total", format="docx")
+    with METRICS.stage("invoice_stage_seconds", operation="generate", stage="pdf"):
+        job_id = write_invoice_pdf(output_docx, invoice_no, replacements, template)
+
+    # API clients get the job to poll instead of the DOCX
+    accept = request.accept_mimetypes
+    if accept.accept_json and not accept.accept_html:
+        return jsonify({
+            "invoice_no": invoice_no,
+            "docx": safe_docx_filename,
+            "template_version": template.version,
+            "job_id": job_id,
+            "status_url": url_for("conversion_job", job_id=job_id) if job_id else None,
+            "download_url": url_for("download_file", filename=secure_filename(pdf_filename(invoice_no)))
+            if PDF_RENDERER == "native" else None,
+        }), 202 if job_id else 201
 
     # Send the DOCX as download
-    return send_file(
+    response = send_file(
         output_docx,
         as_attachment=True,
         download_name=docx_filename,
-        mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        mimetype=DOCX_MIMETYPE
     )
+    if job_id:
+        response.headers["X-Conversion-Job"] = job_id
+    return response
+
+@app.route('/jobs/<job_id>')
+@login_required
+def conversion_job(job_id):
+    job = CONVERSION_JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job_status(job))
+
+@app.route('/templates')
+@login_required
+def template_versions():
+    # Stored template versions, newest first, with the placeholders each has
+    # that /generate does not fill ("unfilled") and the reverse ("unused")
+    return jsonify({"template": UPLOAD_TEMPLATE, "versions": TEMPLATES.versions()})
+
+@app.route('/generate-batch', methods=['POST'])
+@login_required
+def generate_batch():
+    # CSV or JSON array of y_value/date/invoice_suffix/payment_type/hsn_code,
+    # either as an uploaded "file" or as the raw request body.
+    upload = request.files.get("file")
+    if upload is not None:
+        data, filename, content_type = upload.read(), upload.filename or "", upload.mimetype
+    else:
+        data, filename, content_type = request.get_data(), "", request.mimetype
+    try:
+        rows = validate_rows(parse_batch(data, filename, content_type),
+                             default_date=datetime.now().strftime("%Y-%m-%d"))
+        holder = secrets.token_hex(8)
+        jobs = allocate_invoice_numbers(rows, SUFFIX_ALLOCATOR, holder)
+    except BatchError as e:
+        return str(e), 400
+
+    # The whole batch uses the version that is active now
+    try:
+        template = TEMPLATES.active()
+    except LookupError as e:
+        SUFFIX_ALLOCATOR.release_holder(holder)
+        return str(e), 500
+
+    stream = iter_batch_zip(jobs, template, RENDER_ENGINE, OUTPUT_DIR, BATCH_WORKERS,
+                            allocator=SUFFIX_ALLOCATOR, holder=holder, on_saved=batch_invoice_saved(template))
+    return Response(stream, mimetype="application/zip", headers={
+        "Content-Disposition": 'attachment; filename="invoices.zip"',
+    })
+
+@app.route('/download-month/<month_year>')
+@login_required
+def download_month(month_year):
+    # All PDFs for one GB-MMYY- month as a ZIP, streamed entry by entry with
+    # stored (uncompressed) PDFs, so memory use does not grow with the month.
+    if not re.fullmatch(r"\d{4}", month_year):
+        abort(400)
+    invoices = list_invoices_for_month(month_year)
+    if not invoices:
+        abort(404)
+
+    def generate():
+        zs = ZipStream()
+        for inv in invoices:
+            path = os.path.join(OUTPUT_DIR, inv["filename"])
+            try:
+                mtime = time.localtime(os.stat(path).st_mtime)
+            except OSError:
+                continue  # removed since listing
+            yield from zs.write_stream(inv["display_name"], iter_file(path), date_time=mtime)
+        yield zs.close()
+
+    return Response(generate(), mimetype="application/zip", headers={
+        "Content-Disposition": f'attachment; filename="G BUILDCON Invoices - GB-{month_year}.zip"',
+    })
 
 @app.route('/download/<path:filename>')
 @login_required
 def download_file(filename):
     # Validate and ensure only PDFs listed
-    if "/" in filename or "\\" in filename or ".." in filename:
-        abort(400)
-    full_path = os.path.join(OUTPUT_DIR, filename)
-    try:
-        resolved = Path(full_path).resolve()
-        if not str(resolved).startswith(str(Path(OUTPUT_DIR).resolve())):
-            abort(400)
-    except Exception:
+    if "/" in filename or "\\" in filename or ".." in filename or "\x00" in filename:
         abort(400)
-    if not os.path.exists(full_path):
-        abort(404)
     # Only allow PDFs for download (safe)
     if not filename.lower().endswith(".pdf"):
         abort(400)
+    full_path = os.path.join(OUTPUT_ROOT, filename)
+    try:
+        st = os.lstat(full_path)
+        if stat.S_ISLNK(st.st_mode):
+            # the name cannot leave OUTPUT_DIR, but a symlink in it could
+            if not os.path.realpath(full_path).startswith(OUTPUT_ROOT + os.sep):
+                abort(400)
+            st = os.stat(full_path)
+    except OSError:
+        abort(404)
     friendly_name = filename.replace("_", " ")
-    return send_file(full_path, as_attachment=True, download_name=friendly_name, mimetype="application/pdf")
+    # Strong content ETag + Last-Modified; send_file answers If-None-Match /
+    # If-Modified-Since with 304 and Range with 206. Invoices can be
+    # regenerated under the same name, so clients revalidate every time
+    # instead of caching blindly.
+    offload = DOWNLOAD_OFFLOAD != "none"
+    with METRICS.stage("invoice_stage_seconds", operation="download", stage="etag"):
+        etag = DOWNLOAD_ETAGS.get(full_path, st)
+    with METRICS.stage("invoice_stage_seconds", operation="download", stage="prepare"):
+        if offload:
+            # X-Sendfile for this route only; app.config["USE_X_SENDFILE"]
+            # would also apply to the send_file() calls of other routes
+            response = send_file_offloaded(full_path, request.environ, as_attachment=True,
+                                           download_name=friendly_name, mimetype="application/pdf",
+                                           etag=etag, last_modified=st.st_mtime, conditional=False,
+                                           use_x_sendfile=True, response_class=app.response_class)
+        else:
+            response = send_file(full_path, as_attachment=True, download_name=friendly_name,
+                                 mimetype="application/pdf", etag=etag, last_modified=st.st_mtime)
+    if offload:
+        # The front server sends the bytes and serves Range itself; only the
+        # 304 is decided here.
+        if DOWNLOAD_OFFLOAD == "x-accel":
+            del response.headers["X-Sendfile"]
+            response.headers["X-Accel-Redirect"] = DOWNLOAD_ACCEL_PREFIX + quote(filename)
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            response.headers.pop("X-Sendfile", None)
+            response.headers.pop("X-Accel-Redirect", None)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+@app.route('/profiles/<profile_id>/<kind>')
+@login_required
+def profile_file(profile_id, kind):
+    path = PROFILER.path(profile_id, kind)
+    if path is None:
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype=PROFILE_KINDS[kind], as_attachment=kind == "pstats",
+                     download_name=f"{profile_id}.{kind}")
+
+# ---------- Metrics ----------
+@app.route("/metrics")
+def metrics():
+    # Prometheus scrape target; not behind the TOTP login
+    if not METRICS_ENABLED:
+        abort(404)
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get("Authorization", ""),
+                                                    f"Bearer {METRICS_TOKEN}"):
+        abort(401)
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
+    # Development server; run serve.py in production
     app.run(host="0.0.0.0", port=80)
 
@@ -0,0 +1,306 @@
+# batch.py
+# Batch invoice generation: parse a CSV or JSON array of invoice rows,
+# allocate invoice numbers, render across a process pool and stream the
+# DOCX files back as one ZIP in completion order.
+#
+#   python batch.py invoices.csv -o invoices.zip [--workers N] [--engine xml]
+import argparse
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from zipfile import ZIP_STORED
+
+from werkzeug.utils import secure_filename
+
+from invoice_registry import parse_invoice_filename
+from invoices import ENGINE_NAMES, build_replacements, docx_filename, invoice_number, month_year_for, render_docx
+from suffix_allocator import SuffixTaken
+from template_cache import TemplateCache
+from zipstream import ZipStream
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_ROWS = 5000
+
+class BatchError(ValueError):
+    pass
+
+# ---------- Input ----------
+def parse_batch(data, filename="", content_type=""):
+    if isinstance(data, bytes):
+        try:
+            data = data.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise BatchError("Batch file must be UTF-8")
+    is_json = (content_type or "").endswith("json") or filename.lower().endswith(".json") \
+        or data.lstrip().startswith("[")
+    if is_json:
+        try:
+            rows = json.loads(data)
+        except ValueError as e:
+            raise BatchError(f"Invalid JSON: {e}")
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise BatchError("JSON batch must be an array of objects")
+    else:
+        rows = list(csv.DictReader(io.StringIO(data)))
+    if not rows:
+        raise BatchError("Batch is empty")
+    if len(rows) > MAX_BATCH_ROWS:
+        raise BatchError(f"Batch has {len(rows)} rows; the limit is {MAX_BATCH_ROWS}")
+    return rows
+
+def validate_rows(rows, default_date):
+    # Same rules as the /generate form. An empty invoice_suffix is allocated.
+    valid = []
+    for i, row in enumerate(rows, start=1):
+        try:
+            y_value = float(row.get("y_value"))
+        except (TypeError, ValueError):
+            raise BatchError(f"Row {i}: invalid y_value")
+        date_value = str(row.get("date") or default_date).strip()
+        try:
+            datetime.strptime(date_value, "%Y-%m-%d")
+        except ValueError:
+            raise BatchError(f"Row {i}: invalid date {date_value!r}")
+        invoice_suffix = str(row.get("invoice_suffix") or "").strip()
+        if invoice_suffix and not invoice_suffix.isdigit():
+            raise BatchError(f"Row {i}: invoice suffix must be numeric")
+        valid.append({
+            "y_value": y_value,
+            "date": date_value,
+            "invoice_suffix": invoice_suffix,
+            "payment_type": str(row.get("payment_type") or ""),
+            "hsn_code": str(row.get("hsn_code") or ""),
+        })
+    return valid
+
+def allocate_invoice_numbers(rows, allocator, holder):
+    # -> [(invoice_no, replacements), ...]. Suffixes are reserved for
+    # `holder` in the allocator; rows without one get the next free suffix
+    # for their month. On error every reservation made here is released.
+    suffixes = [None] * len(rows)
+    try:
+        # explicit suffixes first, so allocated ones skip them
+        for i, row in enumerate(rows):
+            if row["invoice_suffix"]:
+                try:
+                    allocator.reserve(month_year_for(row["date"]), holder, int(row["invoice_suffix"]))
+                except SuffixTaken as e:
+                    raise BatchError(f"Row {i + 1}: {e}")
+                suffixes[i] = row["invoice_suffix"]
+        for i, row in enumerate(rows):
+            if suffixes[i] is None:
+                suffixes[i] = f"{allocator.reserve(month_year_for(row['date']), holder):02d}"
+
+        jobs = []
+        seen = set()
+        for i, (row, suffix) in enumerate(zip(rows, suffixes), start=1):
+            invoice_no = invoice_number(row["date"], suffix)
+            if invoice_no in seen:
+                raise BatchError(f"Row {i}: duplicate invoice number {invoice_no}")
+            seen.add(invoice_no)
+            jobs.append((invoice_no, build_replacements(
+                row["y_value"], row["date"], invoice_no, row["payment_type"], row["hsn_code"])))
+        return jobs
+    except BaseException:
+        allocator.release_holder(holder)
+        raise
+
+# ---------- Rendering ----------
+_worker_cache = None
+_worker_engine = None
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+
+def _init_worker(template_path, engine, watch=True):
+    global _worker_cache, _worker_engine
+    _worker_cache = TemplateCache(template_path, watch=watch)
+    _worker_engine = engine
+
+def _render_job(invoice_no, replacements):
+    return invoice_no, render_docx(_worker_cache, _worker_engine, replacements)
+
+def get_pool(template, engine, workers):
+    # One long-lived pool per process so workers keep their parsed template
+    # between batches. "spawn" because the web server process is threaded.
+    global _pool, _pool_key
+    key = (template.path, template.watch, engine, workers)
+    with _pool_lock:
+        if _pool is None or _pool_key != key:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(template.path, engine, template.watch),
+            )
+            _pool_key = key
+        return _pool
+
+def discard_pool(pool):
+    # A worker died (OOM, kill): the pool refuses all further work, so the
+    # next get_pool() starts a new one
+    global _pool, _pool_key
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+            _pool_key = None
+    pool.shutdown(wait=False)
+
+def _submit(pool, template, engine, workers, invoice_no, replacements):
+    # -> (pool, future); a pool found broken is replaced once
+    try:
+        return pool, pool.submit(_render_job, invoice_no, replacements)
+    except BrokenProcessPool:
+        discard_pool(pool)
+        pool = get_pool(template, engine, workers)
+        return pool, pool.submit(_render_job, invoice_no, replacements)
+
+def iter_rendered(jobs, template, engine, workers):
+    # Yields (invoice_no, docx bytes or None, error or None) as invoices
+    # complete. `template` is a TemplateCache; pool workers parse their own
+    # copy of the same file.
+    if workers <= 0:
+        for invoice_no, replacements in jobs:
+            try:
+                yield invoice_no, render_docx(template, engine, replacements), None
+            except Exception as e:
+                yield invoice_no, None, e
+        return
+    # Pool failures become failed rows: by now the ZIP response has started
+    pool = get_pool(template, engine, workers)
+    futures = {}
+    for invoice_no, replacements in jobs:
+        try:
+            pool, future = _submit(pool, template, engine, workers, invoice_no, replacements)
+        except Exception as e:
+            yield invoice_no, None, e
+            continue
+        futures[future] = invoice_no
+    for future in as_completed(futures):
+        try:
+            yield future.result() + (None,)
+        except BrokenProcessPool as e:
+            discard_pool(pool)
+            yield futures[future], None, e
+        except Exception as e:
+            yield futures[future], None, e
+
+def iter_batch_zip(jobs, template, engine, output_dir, workers, allocator=None, holder=None,
+                   on_saved=None, on_failed=None):
+    # Generator of ZIP bytes. Each DOCX is also saved into output_dir, like
+    # /generate does (`on_saved(path, invoice_no, replacements)` is called
+    # after each, `on_failed(invoice_no, error)` for each row that could not
+    # be rendered or saved), and a batch_report.json entry closes the archive.
+    # Suffixes reserved for `holder` are committed as invoices are saved;
+    # the rest (failures, aborted downloads) are released at the end.
+    try:
+        yield from _iter_batch_zip(jobs, template, engine, output_dir, workers, allocator, on_saved, on_failed)
+    finally:
+        if allocator is not None:
+            allocator.release_holder(holder)
+
+def _iter_batch_zip(jobs, template, engine, output_dir, workers, allocator, on_saved, on_failed):
+    zs = ZipStream()
+    replacements = dict(jobs)
+    start = time.perf_counter()
+    done = 0
+    failed = []
+    for invoice_no, data, error in iter_rendered(jobs, template, engine, workers):
+        if error is not None:
+            logger.error("Batch render of %s failed: %s", invoice_no, error)
+            failed.append(f"{invoice_no}: {error}")
+            if on_failed is not None:
+                on_failed(invoice_no, error)
+            continue
+        name = docx_filename(invoice_no)
+        path = Path(output_dir, secure_filename(name))
+        try:
+            path.write_bytes(data)
+        except OSError as e:
+            # not in the ZIP either: its suffix is released at the end and
+            # may be issued again
+            logger.exception("Failed to save DOCX: %s", e)
+            failed.append(f"{invoice_no}: {e}")
+            if on_failed is not None:
+                on_failed(invoice_no, e)
+            continue
+        if allocator is not None:
+            _, month_year, suffix = parse_invoice_filename(invoice_no)
+            allocator.commit(month_year, suffix)
+        if on_saved is not None:
+            on_saved(str(path), invoice_no, replacements[invoice_no])
+        done += 1
+        yield zs.write_bytes(name, data, compress_type=ZIP_STORED)
+    elapsed = time.perf_counter() - start
+    report = {
+        "invoices": done,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "invoices_per_second": round(done / elapsed, 2) if elapsed > 0 else None,
+        "engine": engine,
+        "workers": workers,
+    }
+    logger.info("Batch: %d invoices in %.2fs (%s/s)", done, elapsed, report["invoices_per_second"])
+    yield zs.write_bytes("batch_report.json", json.dumps(report, indent=2).encode("utf-8"))
+    yield zs.close()
+
+# ---------- CLI ----------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a batch of invoices into a ZIP")
+    parser.add_argument("input", help="CSV or JSON file with y_value,date,invoice_suffix,payment_type,hsn_code")
+    parser.add_argument("-o", "--output", default="invoices.zip", help="ZIP file to write")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="render processes (0 = in-process)")
+    parser.add_argument("--engine", default=None, choices=ENGINE_NAMES,
+                        help="render engine (defaults to INVOICE_RENDER_ENGINE)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    import app  # OUTPUT_DIR, the template path and the allocator live with the web app
+
+    engine = args.engine or app.RENDER_ENGINE
+    holder = secrets.token_hex(8)
+    try:
+        data = Path(args.input).read_bytes()
+        rows = validate_rows(parse_batch(data, args.input), default_date=datetime.now().strftime("%Y-%m-%d"))
+        jobs = allocate_invoice_numbers(rows, app.SUFFIX_ALLOCATOR, holder)
+    except (OSError, BatchError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    try:
+        template = app.TEMPLATES.active()
+    except LookupError as e:
+        app.SUFFIX_ALLOCATOR.release_holder(holder)
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    # Saved invoices get their PDF and template record exactly as in
+    # /generate-batch; queued conversions finish before the process exits
+    failed = []
+    with open(args.output, "wb") as fh:
+        for chunk in iter_batch_zip(jobs, template, engine, app.OUTPUT_DIR, args.workers,
+                                    allocator=app.SUFFIX_ALLOCATOR, holder=holder,
+                                    on_saved=app.batch_invoice_saved(template),
+                                    on_failed=lambda invoice_no, error: failed.append(invoice_no)):
+            fh.write(chunk)
+    if failed:
+        print(f"error: {len(failed)} of {len(jobs)} invoices failed: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
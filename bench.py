@@ -0,0 +1,556 @@
+# bench.py
+# Standalone benchmarks for the invoice pipeline.
+#   python bench.py [-n ITERATIONS] [--office N]
+#   python bench.py --check        number words + native PDF vs reference, exit 1 on failure
+#   python bench.py --pdf-diff [reference.pdf] [--pdf-values 537334 2025-12-02 01 Cheque 9954]
+#   python bench.py --report bench.json [--dirs 10 10000 100000] [--client-requests 200]
+#   APP_SECRET=... python bench.py --load http://127.0.0.1:8000 [--concurrency 16] [--duration 10]
+import argparse
+import http.client
+import json
+import platform
+import os
+import random
+import statistics
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from num2words import num2words
+
+from docx_render import RENDER_ENGINES, remove_trailing_empty_paragraphs, replace_placeholders_in_doc
+from invoices import build_replacements, invoice_number, pdf_filename, render_docx, render_pdf
+from template_cache import TemplateCache
+from utils import INDIAN_WORDS_MAX, indian_number_words, number_to_words_indian
+
+UPLOAD_TEMPLATE = "uploads/template.docx"
+# The native PDF of PDF_REFERENCE_VALUES, as reviewed when it was committed.
+# Regenerate it (python bench.py --pdf-diff --pdf-update) only for an
+# intended change to the template or the PDF layout.
+PDF_REFERENCE = "reference/invoice_GB-1225-01.pdf"
+PDF_REFERENCE_VALUES = ["537334", "2025-12-02", "01", "Cheque", "9954"]
+# Same renderer, same values: only anti-aliasing noise may differ (one
+# rupee more in the amount changes ~0.05% of the pixels). Other
+# references, e.g. saved from Word, get PDF_DIFF_MAX.
+PDF_REFERENCE_MAX = 0.0001
+PDF_DIFF_MAX = 0.02
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def sample_replacements(compiled):
+    replacements = {name: "12345.67" for name in compiled.placeholders}
+    replacements["{{sub_total_words}}"] = "Twelve Thousand Three Hundred And Forty-Six Rupees Only"
+    replacements["{{tax_to_words}}"] = "One Thousand Eight Hundred And Eighty-Three Rupees Only"
+    replacements["{{date}}"] = "01/12/2025"
+    replacements["{{invoice_no}}"] = "GB-1225-01"
+    return replacements
+
+def timeit(fn, n):
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000.0
+
+def bench_engines(cache, n):
+    _, compiled = cache.snapshot()
+    replacements = sample_replacements(compiled)
+    results = {}
+    for name, engine in RENDER_ENGINES.items():
+        def render():
+            doc, compiled = cache.get()
+            engine(doc, compiled, replacements)
+            remove_trailing_empty_paragraphs(doc)
+            doc.save(BytesIO())
+        def substitute_only():
+            doc, compiled = cache.get()
+            start = time.perf_counter()
+            engine(doc, compiled, replacements)
+            return time.perf_counter() - start
+        substitute_only()
+        substitution_ms = sum(substitute_only() for _ in range(n)) / n * 1000.0
+        results[name] = {"invoice_ms": timeit(render, n), "substitution_ms": substitution_ms}
+    stencil = cache.stencil()
+    xml_ms = timeit(lambda: stencil.render(replacements), n)
+    results["xml"] = {"invoice_ms": xml_ms, "substitution_ms": xml_ms}
+    return results
+
+def bench_pdf(cache, n, office=0):
+    # Invoices/second for the native PDF renderer against producing the
+    # DOCX and, with office=N, converting N of them through LibreOffice.
+    _, compiled = cache.snapshot()
+    replacements = sample_replacements(compiled)
+    cache.pdf_layout()
+    results = {
+        "native_pdf_ms": timeit(lambda: render_pdf(cache, replacements), n),
+        "docx_ms": timeit(lambda: render_docx(cache, "lxml", replacements), n),
+    }
+    if office:
+        from pdf_convert import ConversionPool
+        pool = ConversionPool(size=1)
+        tmp = tempfile.mkdtemp(prefix="bench-pdf-")
+        try:
+            src = os.path.join(tmp, "invoice.docx")
+            with open(src, "wb") as fh:
+                fh.write(render_docx(cache, "lxml", replacements))
+            pool.warm_up()
+            start = time.perf_counter()
+            for i in range(office):
+                pool.convert(src, os.path.join(tmp, f"invoice{i}.pdf"))
+            results["office_pdf_ms"] = results["docx_ms"] + (time.perf_counter() - start) / office * 1000.0
+        finally:
+            pool.close()
+            shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+def bench_stages(n):
+    # The uncached pipeline stage by stage, each timed on its own input
+    from docx import Document
+    replacements = build_replacements(537334.0, "2025-12-02", "GB-1225-01", "Cheque", "9954")
+    def per_call(stage, prepare):
+        times = []
+        for _ in range(n + 1):
+            arg = prepare()
+            start = time.perf_counter()
+            stage(arg)
+            times.append(time.perf_counter() - start)
+        return sum(times[1:]) / n * 1000.0  # first call warms up
+    def substituted():
+        doc = Document(UPLOAD_TEMPLATE)
+        replace_placeholders_in_doc(doc, replacements)
+        remove_trailing_empty_paragraphs(doc)
+        return doc
+    rng = random.Random(2)
+    amounts = [round(rng.uniform(100, 200000), 2) for _ in range(1000)]
+    return {
+        "document_load_ms": timeit(lambda: Document(UPLOAD_TEMPLATE), n),
+        "replace_placeholders_ms": per_call(lambda doc: replace_placeholders_in_doc(doc, replacements),
+                                            lambda: Document(UPLOAD_TEMPLATE)),
+        "remove_trailing_empty_ms": per_call(remove_trailing_empty_paragraphs, lambda: Document(UPLOAD_TEMPLATE)),
+        "number_to_words_us": timeit(lambda: [number_to_words_indian(a) for a in amounts], max(1, n // 10))
+                              * 1000.0 / len(amounts),
+        "doc_save_ms": per_call(lambda doc: doc.save(BytesIO()), substituted),
+    }
+
+def rasterize(pdf_path, dpi):
+    # First page as a greyscale PIL image: PyMuPDF if installed, else
+    # poppler's pdftoppm.
+    from PIL import Image
+    try:
+        import pymupdf
+    except ImportError:
+        pymupdf = None
+    if pymupdf is not None:
+        pix = pymupdf.open(pdf_path)[0].get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY)
+        return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    if shutil.which("pdftoppm") is None:
+        raise RuntimeError("--pdf-diff needs PyMuPDF or poppler's pdftoppm")
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run(["pdftoppm", "-gray", "-r", str(dpi), "-f", "1", "-l", "1", "-singlefile", "-png",
+                        pdf_path, os.path.join(tmp, "page")], check=True)
+        return Image.open(os.path.join(tmp, "page.png")).copy()
+
+def native_pdf(cache, values):
+    y_value, date_value, suffix, payment_type, hsn_code = values
+    replacements = build_replacements(float(y_value), date_value, invoice_number(date_value, suffix),
+                                      payment_type, hsn_code)
+    return render_pdf(cache, replacements)
+
+def pdf_visual_diff(cache, reference, values, dpi=50, diff_png="pdf_diff.png"):
+    # Renders the invoice for `values` natively and compares it with a
+    # reference PDF (PDF_REFERENCE, or e.g. one saved from Word for the same
+    # invoice): the share of pixels that differ after a slight blur, which
+    # absorbs sub-pixel shifts and font hinting. Writes the difference image
+    # to `diff_png`.
+    from PIL import ImageChops, ImageFilter
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as fh:
+        fh.write(native_pdf(cache, values))
+    try:
+        ours = rasterize(fh.name, dpi)
+    finally:
+        os.remove(fh.name)
+    theirs = rasterize(reference, dpi)
+    if theirs.size != ours.size:
+        theirs = theirs.resize(ours.size)
+    blur = ImageFilter.GaussianBlur(1)
+    diff = ImageChops.difference(ours.filter(blur), theirs.filter(blur))
+    changed = sum(diff.point(lambda v: 255 if v > 64 else 0).histogram()[255:])
+    ImageChops.invert(diff).save(diff_png)
+    return changed / float(ours.width * ours.height)
+
+def session_cookie(secret):
+    # A logged-in session cookie for a server running with APP_SECRET and
+    # the default cookie sessions (SESSION_BACKEND=cookie)
+    from flask import Flask
+    signer = Flask("bench")
+    signer.secret_key = secret
+    return "session=" + signer.session_interface.get_signing_serializer(signer).dumps({"authenticated": True, "suffix_holder": "bench"})
+
+LOAD_MONTHS = 12
+
+def load_request(path, index, counter):
+    # (method, path, body) for one request; /generate numbers invoices in
+    # 2099 per thread and count, so concurrent requests never collide
+    if path != "/generate":
+        return "GET", path, None
+    month = index % LOAD_MONTHS + 1
+    suffix = index // LOAD_MONTHS * 100000 + counter + 1
+    body = urlencode({"y_value": 537334, "date": f"2099-{month:02d}-01", "invoice_suffix": suffix,
+                      "payment_type": "Cheque", "hsn_code": "9954"})
+    return "POST", path, body
+
+def load_test(base_url, cookie, path, concurrency, duration):
+    # Requests/second and latency for `path` from `concurrency` keep-alive
+    # clients over `duration` seconds against a running server.
+    url = urlsplit(base_url)
+    deadline = time.perf_counter() + duration
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client(index):
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+        mine, counter = [], 0
+        while time.perf_counter() < deadline:
+            method, req_path, body = load_request(path, index, counter)
+            counter += 1
+            headers = {"Cookie": cookie, "Accept": "application/json"}
+            if body:
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+            start = time.perf_counter()
+            try:
+                conn.request(method, url.path.rstrip("/") + req_path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                with lock:
+                    errors.append(repr(e))
+                continue
+            if resp.status >= 300:
+                with lock:
+                    errors.append(str(resp.status))
+                continue
+            mine.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000.0 if latencies else 0.0
+    return {"requests": len(latencies), "errors": len(errors), "rps": len(latencies) / elapsed,
+            "p50_ms": pct(0.5), "p95_ms": pct(0.95), "first_error": errors[0] if errors else None}
+
+# ---------- Scratch app instances ----------
+# app.py keeps its state relative to the working directory (output/,
+# uploads/), so directory-size and test-client runs import it in a child
+# process inside a temporary directory: a synthetic output/ of N invoices
+# and a link to the real uploads/.
+
+SCRATCH_ENV = {"PDF_CONVERT_WORKERS": "0", "RENDER_CACHE_MAX_MB": "0", "APP_PRELOAD": "0",
+               "INVOICE_BATCH_WORKERS": "0", "APP_SECRET": "bench"}
+
+def synthetic_output(path, count):
+    # `count` empty invoice PDFs spread over 120 months
+    os.makedirs(path)
+    for i in range(count):
+        date_value = f"{2015 + i // 12 % 10}-{i % 12 + 1:02d}-01"
+        name = pdf_filename(invoice_number(date_value, f"{i // 120 + 1:02d}"))
+        open(os.path.join(path, name), "wb").close()
+
+def run_scratch(count, client_requests):
+    tmp = tempfile.mkdtemp(prefix="bench-app-")
+    try:
+        synthetic_output(os.path.join(tmp, "output"), count)
+        # the template is read through the link; its stored versions stay here
+        os.symlink(os.path.join(HERE, "uploads"), os.path.join(tmp, "uploads"))
+        env = dict(os.environ, PYTHONPATH=HERE, TEMPLATE_VERSIONS_DIR=os.path.join(tmp, "template_versions"),
+                   **SCRATCH_ENV)
+        proc = subprocess.run([sys.executable, os.path.join(HERE, "bench.py"), "--scratch-child",
+                               str(client_requests)], cwd=tmp, env=env, capture_output=True, text=True)
+        if proc.returncode:
+            raise RuntimeError(f"scratch run failed:\n{proc.stderr}")
+        return json.loads(proc.stdout.splitlines()[-1])
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def scratch_child(client_requests):
+    # Runs inside run_scratch(): app startup against the synthetic output/,
+    # the listing and suffix functions, then each route through the Flask
+    # test client. Prints one JSON line.
+    start = time.perf_counter()
+    import app
+    result = {"app_import_ms": (time.perf_counter() - start) * 1000.0}
+    n = 20
+    with app.app.test_request_context():
+        result["list_existing_invoices_ms"] = timeit(lambda: app.list_existing_invoices(0, app.INVOICES_PER_PAGE), n)
+        result["list_invoices_for_month_ms"] = timeit(lambda: app.list_invoices_for_month("0115"), n)
+        result["get_next_suffix_for_month_ms"] = timeit(lambda: app.get_next_suffix_for_month("0115"), n)
+        result["get_next_suffix_held_ms"] = timeit(lambda: app.get_next_suffix_for_month("0115", "bench"), n)
+        result["rebuild_from_directory_ms"] = timeit(
+            lambda: app.SUFFIX_ALLOCATOR.rebuild_from_directory(app.OUTPUT_DIR), max(1, n // 4))
+    if client_requests:
+        result["client"] = {path: client_load(app.app, path, client_requests)
+                            for path in ("/", "/next-suffix?date=2099-01-01", "/generate")}
+    print(json.dumps(result))
+
+def client_load(flask_app, path, requests):
+    # `requests` sequential requests through the Flask test client: the app's
+    # own cost per request, without a server or network in the way
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess["authenticated"] = True
+        sess["suffix_holder"] = "bench"
+    latencies, errors = [], []
+    start = time.perf_counter()
+    for i in range(requests):
+        method, req_path, body = load_request(path, 0, i)
+        t0 = time.perf_counter()
+        resp = client.open(req_path, method=method, data=body, headers={"Accept": "application/json"},
+                           content_type="application/x-www-form-urlencoded" if body else None)
+        if resp.status_code >= 300:
+            errors.append(str(resp.status_code))
+        else:
+            latencies.append(time.perf_counter() - t0)
+        resp.close()
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def num2words_indian(n):
+    return num2words(n, lang='en_IN').replace(",", "").title()
+
+def num2words_amount(amount):
+    # number_to_words_indian as it was before the table-driven converter
+    rupees_str, paise_str = "{:.2f}".format(float(amount)).split(".")
+    rupees_words = num2words_indian(int(rupees_str))
+    if int(paise_str) > 0:
+        return f"{rupees_words} Rupees And {num2words_indian(int(paise_str))} Paise Only"
+    return f"{rupees_words} Rupees Only"
+
+def verify_words(count, seed=0):
+    # Differential check of utils.indian_number_words against num2words:
+    # 0..count exhaustively, then `count` random values up to the 10^10
+    # limit and `count` random rupee/paise amounts.
+    rng = random.Random(seed)
+    values = list(range(count + 1)) + [rng.randrange(INDIAN_WORDS_MAX) for _ in range(count)]
+    for i, n in enumerate(values):
+        expected = num2words_indian(n)
+        got = indian_number_words(n)
+        if got != expected:
+            raise AssertionError(f"{n}: {got!r} != {expected!r}")
+        if i and i % 500000 == 0:
+            print(f"  {i} values ok")
+    for _ in range(count):
+        amount = round(rng.uniform(0, 10 ** 9), 2)
+        if number_to_words_indian(amount) != num2words_amount(amount):
+            raise AssertionError(f"{amount}: {number_to_words_indian(amount)!r} != {num2words_amount(amount)!r}")
+    return len(values) + count
+
+def bench_words(n):
+    rng = random.Random(1)
+    amounts = [round(rng.uniform(100, 200000), 2) for _ in range(1000)]
+    def run(fn):
+        start = time.perf_counter()
+        for _ in range(max(1, n // 10)):
+            for a in amounts:
+                fn(a)
+        return (time.perf_counter() - start) / (max(1, n // 10) * len(amounts)) * 1e6
+    return {
+        "num2words_us": run(num2words_amount),
+        "table_us": run(lambda a: indian_number_words(int(a))),
+        "cached_us": run(number_to_words_indian),
+    }
+
+IMPORT_PROBE = "import sys, app; print(','.join(m for m in app.HEAVY_MODULES if m in sys.modules))"
+
+def import_profile(runs=5, preload=False):
+    # Cold `import app` under python -X importtime, in a fresh interpreter
+    # each run. Returns the median cumulative time, the heavy modules that
+    # ended up loaded and the slowest modules (self time) of the last run.
+    env = dict(os.environ, APP_PRELOAD="1" if preload else "0")
+    totals = []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_PROBE],
+                              capture_output=True, text=True, env=env, check=True)
+        modules = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            modules.append((int(self_us), int(cumulative_us), name.strip()))
+        totals.append(next(c for _, c, name in modules if name == "app"))
+    slowest = sorted(modules, reverse=True)[:8]
+    return {
+        "import_app_ms": statistics.median(totals) / 1000.0,
+        "heavy_loaded": [m for m in proc.stdout.strip().split(",") if m],
+        "slowest_self_ms": [(name, self_us / 1000.0) for self_us, _, name in slowest],
+    }
+
+# ---------- Correctness checks ----------
+def check_pdf(reference, values, max_ratio):
+    ratio = pdf_visual_diff(TemplateCache(UPLOAD_TEMPLATE), reference, values)
+    ok = ratio <= max_ratio
+    print(f"native PDF vs {reference}: {ratio:.2%} of pixels differ (max {max_ratio:.2%}), "
+          f"difference image in pdf_diff.png{'' if ok else '  FAILED'}")
+    return ok
+
+def check_words(count):
+    try:
+        checked = verify_words(count)
+    except AssertionError as e:
+        print(f"number words: FAILED at {e}")
+        return False
+    print(f"number words: {checked} values match num2words")
+    return True
+
+def run_checks(args):
+    # -> True when every check passed
+    ok = check_words(args.verify_words) if args.verify_words else True
+    return check_pdf(PDF_REFERENCE, PDF_REFERENCE_VALUES, PDF_REFERENCE_MAX) and ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Invoice pipeline benchmarks")
+    parser.add_argument("-n", type=int, default=50, help="iterations per measurement")
+    parser.add_argument("--verify-words", type=int, default=10000, metavar="N",
+                        help="differential check of the Indian number words against num2words over ~3N values "
+                             "(part of the checks; 0 skips it)")
+    parser.add_argument("--importtime", action="store_true", help="only profile the cold import of app.py")
+    parser.add_argument("--office", type=int, default=0, metavar="N",
+                        help="also time N DOCX->PDF conversions through LibreOffice")
+    parser.add_argument("--check", action="store_true",
+                        help="only run the correctness checks (also run before the benchmarks); exit 1 on failure")
+    parser.add_argument("--pdf-diff", metavar="REFERENCE_PDF", nargs="?", const=PDF_REFERENCE,
+                        help=f"only compare the native PDF with a reference PDF of the same invoice "
+                             f"(default {PDF_REFERENCE})")
+    parser.add_argument("--pdf-update", action="store_true",
+                        help="with --pdf-diff: write the native PDF to the reference instead of comparing")
+    parser.add_argument("--pdf-values", nargs=5, metavar=("Y_VALUE", "DATE", "SUFFIX", "PAYMENT", "HSN"),
+                        default=PDF_REFERENCE_VALUES, help="form values of the reference invoice")
+    parser.add_argument("--pdf-diff-max", type=float,
+                        help=f"fail when more than this share of pixels differs "
+                             f"(default {PDF_REFERENCE_MAX} for {PDF_REFERENCE}, else {PDF_DIFF_MAX})")
+    parser.add_argument("--load", metavar="BASE_URL",
+                        help="only load-test /, /next-suffix and /generate on a running server "
+                             "(signs a session with $APP_SECRET; /generate writes GB-xx99-* invoices)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients for --load")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per path for --load")
+    parser.add_argument("--dirs", type=int, nargs="*", default=[10, 10000, 100000], metavar="N",
+                        help="synthetic output/ sizes for the listing, suffix and test-client runs")
+    parser.add_argument("--client-requests", type=int, default=200, metavar="N",
+                        help="Flask test-client requests per route and output/ size (0: skip)")
+    parser.add_argument("--report", metavar="PATH", help="also write every result to PATH as JSON")
+    parser.add_argument("--scratch-child", type=int, metavar="N", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scratch_child is not None:
+        scratch_child(args.scratch_child)
+        return
+
+    if args.load:
+        secret = os.environ.get("APP_SECRET")
+        if not secret:
+            sys.exit("--load needs the server's APP_SECRET in the environment")
+        cookie = session_cookie(secret)
+        for path in ("/", "/next-suffix?date=2099-01-01", "/generate"):
+            res = load_test(args.load, cookie, path, args.concurrency, args.duration)
+            line = f"{path:<30} {res['rps']:8.1f} req/s   p50 {res['p50_ms']:7.1f} ms   p95 {res['p95_ms']:7.1f} ms"
+            if res["errors"]:
+                line += f"   {res['errors']} errors (first: {res['first_error']})"
+            print(line)
+        return
+
+    if args.pdf_diff and args.pdf_update:
+        with open(args.pdf_diff, "wb") as fh:
+            fh.write(native_pdf(TemplateCache(UPLOAD_TEMPLATE), args.pdf_values))
+        print(f"native PDF written to {args.pdf_diff}")
+        return
+
+    if args.pdf_diff:
+        max_ratio = args.pdf_diff_max
+        if max_ratio is None:
+            max_ratio = PDF_REFERENCE_MAX if args.pdf_diff == PDF_REFERENCE else PDF_DIFF_MAX
+        sys.exit(0 if check_pdf(args.pdf_diff, args.pdf_values, max_ratio) else 1)
+
+    if args.check:
+        sys.exit(0 if run_checks(args) else 1)
+
+    if args.importtime:
+        for preload in (False, True):
+            res = import_profile(preload=preload)
+            print(f"import app (APP_PRELOAD={int(preload)}): {res['import_app_ms']:.1f} ms, "
+                  f"heavy modules loaded: {', '.join(res['heavy_loaded']) or 'none'}")
+            for name, ms in res["slowest_self_ms"]:
+                print(f"    {ms:7.2f} ms  {name}")
+        return
+
+    checks_ok = run_checks(args)
+    report = {"revision": git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "iterations": args.n}
+    cache = TemplateCache(UPLOAD_TEMPLATE)
+    report["template"] = {
+        "load_compile_ms": timeit(lambda: TemplateCache(UPLOAD_TEMPLATE).snapshot(), max(1, args.n // 10)),
+        "copy_ms": timeit(cache.get, args.n),
+    }
+    print(f"template load+compile: {report['template']['load_compile_ms']:.2f} ms")
+    print(f"template copy:         {report['template']['copy_ms']:.2f} ms")
+    stages = report["stages"] = bench_stages(args.n)
+    print(f"uncached stages: Document() {stages['document_load_ms']:.2f} ms   "
+          f"replace_placeholders {stages['replace_placeholders_ms']:.2f} ms   "
+          f"remove_trailing_empty {stages['remove_trailing_empty_ms']:.3f} ms   "
+          f"save {stages['doc_save_ms']:.2f} ms   amount words {stages['number_to_words_us']:.2f} us")
+    report["engines"] = bench_engines(cache, args.n)
+    for name, res in report["engines"].items():
+        print(f"engine {name:<5} substitution {res['substitution_ms']:7.3f} ms   full invoice {res['invoice_ms']:7.2f} ms")
+    pdf = report["pdf"] = bench_pdf(cache, args.n, args.office)
+    line = f"native PDF {pdf['native_pdf_ms']:.2f} ms ({1000 / pdf['native_pdf_ms']:.0f}/s)   " \
+           f"DOCX {pdf['docx_ms']:.2f} ms ({1000 / pdf['docx_ms']:.0f}/s)"
+    if "office_pdf_ms" in pdf:
+        line += f"   DOCX+LibreOffice PDF {pdf['office_pdf_ms']:.1f} ms ({1000 / pdf['office_pdf_ms']:.1f}/s)"
+    print(line)
+    words = report["words"] = bench_words(args.n)
+    print(f"amount in words: num2words {words['num2words_us']:.2f} us   tables {words['table_us']:.2f} us   "
+          f"cached {words['cached_us']:.2f} us")
+
+    report["output_dirs"] = {}
+    for count in args.dirs:
+        res = report["output_dirs"][str(count)] = run_scratch(count, args.client_requests)
+        print(f"output/ with {count} invoices: app import {res['app_import_ms']:.1f} ms   "
+              f"list page {res['list_existing_invoices_ms']:.2f} ms   "
+              f"month {res['list_invoices_for_month_ms']:.2f} ms   "
+              f"next suffix {res['get_next_suffix_for_month_ms']:.2f} ms (held {res['get_next_suffix_held_ms']:.2f} ms)   "
+              f"rebuild {res['rebuild_from_directory_ms']:.1f} ms")
+        for path, load in res.get("client", {}).items():
+            line = f"    test client {path:<30} {load['rps']:8.1f} req/s   p50 {load['p50_ms']:6.2f} ms   " \
+                   f"p95 {load['p95_ms']:6.2f} ms"
+            if load["errors"]:
+                line += f"   {load['errors']} errors (first: {load['first_error']})"
+            print(line)
+
+    if args.report:
+        with open(args.report, "w") as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+        print(f"report written to {args.report}")
+    if not checks_ok:
+        sys.exit("correctness checks failed, see above")
+
+if __name__ == "__main__":
+    main()
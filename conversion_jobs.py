@@ -0,0 +1,103 @@
+# conversion_jobs.py
+# Status of background DOCX -> PDF conversions, in SQLite next to the
+# invoice index so /jobs/<id> answers the same from every worker process,
+# not only the one whose pool is running the conversion. Each job records
+# the pid of the worker process that queued it: when that process is gone
+# (killed at a timeout, OOM) before the job finished, the job is marked
+# failed instead of staying queued/running forever.
+import os
+import secrets
+import sqlite3
+import time
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversion_jobs (
+    id         TEXT PRIMARY KEY,
+    invoice_no TEXT,
+    docx       TEXT NOT NULL,
+    pdf        TEXT NOT NULL,
+    status     TEXT NOT NULL,
+    error      TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    owner      INTEGER
+);
+CREATE INDEX IF NOT EXISTS conversion_jobs_updated ON conversion_jobs (updated_at);
+"""
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# finished jobs are forgotten after a day
+DEFAULT_KEEP = 24 * 60 * 60
+
+ORPHANED = "conversion worker exited before the job finished"
+
+def _alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class ConversionJobs:
+    def __init__(self, db_path, keep=DEFAULT_KEEP):
+        self.db_path = db_path
+        self.keep = keep
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(conversion_jobs)")]
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE conversion_jobs ADD COLUMN owner INTEGER")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, docx, pdf, invoice_no=None):
+        job_id = secrets.token_urlsafe(12)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM conversion_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                         (DONE, FAILED, now - self.keep))
+            conn.execute("INSERT INTO conversion_jobs VALUES (?, ?, ?, ?, ?, NULL, ?, ?, ?)",
+                         (job_id, invoice_no, docx, pdf, QUEUED, now, now, os.getpid()))
+        return job_id
+
+    def mark(self, job_id, status, error=None):
+        with self._connect() as conn:
+            conn.execute("UPDATE conversion_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                         (status, error, time.time(), job_id))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM conversion_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if job["status"] in (QUEUED, RUNNING) and not _alive(job["owner"]):
+            self.mark(job_id, FAILED, ORPHANED)
+            job.update(status=FAILED, error=ORPHANED)
+        return job
+
+    def fail_orphaned(self):
+        # Unfinished jobs of processes that no longer exist, e.g. at startup
+        # after a crash. -> number of jobs marked failed
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, owner FROM conversion_jobs WHERE status IN (?, ?)",
+                                (QUEUED, RUNNING)).fetchall()
+            orphaned = [row["id"] for row in rows if not _alive(row["owner"])]
+            conn.executemany("UPDATE conversion_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                             [(FAILED, ORPHANED, time.time(), job_id) for job_id in orphaned])
+        return len(orphaned)
@@ -0,0 +1,370 @@
+# docx_render.py
+import re
+import zipfile
+from io import BytesIO
+from xml.sax.saxutils import escape as xml_escape
+
+from zipstream import PreparedEntry, ZipStream
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+def _w(tag):
+    return f"{{{W_NS}}}{tag}"
+
+W_P, W_R, W_T, W_RPR, W_B = _w("p"), _w("r"), _w("t"), _w("rPr"), _w("b")
+W_TAB, W_BR, W_CR = _w("tab"), _w("br"), _w("cr")
+W_PTAB, W_NO_BREAK_HYPHEN, W_TYPE = _w("ptab"), _w("noBreakHyphen"), _w("type")
+
+# ---------- Placeholder replacement & doc helpers ----------
+PLACEHOLDER_RE = re.compile(r'(\{\{[^}]+\}\})')
+
+BOLD_KEYS = {
+    "{{base_amo}}","{{cgst_c}}","{{sgst_c}}","{{tax_t}}","{{sub_total_words}}","{{tax_to_words}}"
+}
+BOLD_PARAGRAPH_KEYS = {"{{sub_total_words}}","{{tax_to_words}}","{{sub_total}}"}
+
+def _placeholder_segments(full_text, replacements):
+    # [(text, bold), ...] for a paragraph's joined run text, or None when no
+    # placeholder matched.
+    paragraph_should_be_bold = any(k in full_text for k in BOLD_PARAGRAPH_KEYS)
+    segments=[]
+    idx=0
+    found=False
+    for m in PLACEHOLDER_RE.finditer(full_text):
+        found=True
+        start,end=m.span()
+        placeholder=m.group(1)
+        if start>idx:
+            segments.append((full_text[idx:start], paragraph_should_be_bold))
+        replacement_text = replacements.get(placeholder, placeholder)
+        is_bold = paragraph_should_be_bold or (placeholder in BOLD_KEYS)
+        segments.append((replacement_text, is_bold))
+        idx=end
+    if idx < len(full_text):
+        segments.append((full_text[idx:], paragraph_should_be_bold))
+    if not found:
+        return None
+    return segments
+
+def replace_placeholders_in_paragraph(paragraph, replacements):
+    full_text = ''.join(run.text for run in paragraph.runs)
+    if "{{" not in full_text:
+        return
+    segments = _placeholder_segments(full_text, replacements)
+    if segments is None:
+        return
+    for r in paragraph.runs:
+        r.text=""
+    for text, bold_flag in segments:
+        if not text:
+            continue
+        r = paragraph.add_run(text)
+        if bold_flag:
+            r.bold=True
+
+def replace_placeholders_in_table(table, replacements):
+    for row in table.rows:
+        for cell in row.cells:
+            replace_placeholders_in_block(cell, replacements)
+
+def replace_placeholders_in_block(block, replacements):
+    if hasattr(block, "paragraphs"):
+        for p in list(block.paragraphs):
+            replace_placeholders_in_paragraph(p, replacements)
+    if hasattr(block, "tables"):
+        for t in block.tables:
+            replace_placeholders_in_table(t, replacements)
+
+def replace_placeholders_in_doc(doc, replacements):
+    replace_placeholders_in_block(doc, replacements)
+    for section in doc.sections:
+        try:
+            replace_placeholders_in_block(section.header, replacements)
+        except Exception:
+            pass
+        try:
+            replace_placeholders_in_block(section.footer, replacements)
+        except Exception:
+            pass
+
+def is_paragraph_empty(paragraph):
+    if paragraph.text and paragraph.text.strip():
+        return False
+    for run in paragraph.runs:
+        if run.text and run.text.strip():
+            return False
+    return True
+
+def remove_trailing_empty_paragraphs_from_block(block):
+    if not hasattr(block, "paragraphs"):
+        return
+    while block.paragraphs:
+        last = block.paragraphs[-1]
+        if is_paragraph_empty(last):
+            p_el = last._element
+            parent = p_el.getparent()
+            if parent is not None:
+                parent.remove(p_el)
+            else:
+                break
+        else:
+            break
+
+def remove_trailing_empty_paragraphs(doc):
+    remove_trailing_empty_paragraphs_from_block(doc)
+    for section in doc.sections:
+        try:
+            remove_trailing_empty_paragraphs_from_block(section.header)
+        except Exception:
+            pass
+        try:
+            remove_trailing_empty_paragraphs_from_block(section.footer)
+        except Exception:
+            pass
+
+# ---------- Compiled templates ----------
+# A template is compiled once per version: we walk it exactly the way
+# replace_placeholders_in_doc does and remember where the placeholder
+# paragraphs live (part name + child-index path from the part root). Rendering
+# a deep copy of the same template then only touches those paragraphs.
+
+class CompiledTemplate:
+    def __init__(self, targets):
+        # [(partname, path, placeholder names), ...] in document order
+        self.targets = targets
+
+    @property
+    def placeholders(self):
+        names = set()
+        for _, _, found in self.targets:
+            names.update(found)
+        return names
+
+def _iter_block_paragraphs(block):
+    if hasattr(block, "paragraphs"):
+        for p in list(block.paragraphs):
+            yield p
+    if hasattr(block, "tables"):
+        for t in block.tables:
+            for row in t.rows:
+                for cell in row.cells:
+                    yield from _iter_block_paragraphs(cell)
+
+def _iter_doc_paragraphs(doc):
+    yield from _iter_block_paragraphs(doc)
+    for section in doc.sections:
+        for name in ("header", "footer"):
+            try:
+                yield from _iter_block_paragraphs(getattr(section, name))
+            except Exception:
+                pass
+
+def _element_path(el):
+    path = []
+    parent = el.getparent()
+    while parent is not None:
+        path.append(parent.index(el))
+        el = parent
+        parent = el.getparent()
+    return tuple(reversed(path))
+
+def _resolve_path(root, path):
+    el = root
+    for i in path:
+        el = el[i]
+    return el
+
+def compile_template(doc):
+    # Note: like the per-request walk this replaces, touching section
+    # headers/footers makes python-docx add default definitions to `doc`.
+    targets = []
+    seen = set()
+    for paragraph in _iter_doc_paragraphs(doc):
+        full_text = ''.join(run.text for run in paragraph.runs)
+        if "{{" not in full_text:
+            continue
+        names = PLACEHOLDER_RE.findall(full_text)
+        if not names:
+            continue
+        p_el = paragraph._p
+        key = (str(paragraph.part.partname), _element_path(p_el))
+        if key in seen:
+            continue
+        seen.add(key)
+        targets.append((key[0], key[1], tuple(names)))
+    return CompiledTemplate(targets)
+
+def _part_roots(doc):
+    roots = {}
+    for part in doc.part.package.iter_parts():
+        element = getattr(part, "element", None)
+        if element is not None:
+            roots[str(part.partname)] = element
+    return roots
+
+def replace_compiled_placeholders(doc, compiled, replacements):
+    # `doc` must be a copy of the document `compiled` was built from.
+    from docx.text.paragraph import Paragraph
+    roots = _part_roots(doc)
+    for partname, path, _ in compiled.targets:
+        p_el = _resolve_path(roots[partname], path)
+        replace_placeholders_in_paragraph(Paragraph(p_el, doc), replacements)
+
+# ---------- lxml substitution engine ----------
+# Same output as replace_placeholders_in_paragraph, but works on the w:p /
+# w:r / w:t elements directly instead of building Run/Paragraph wrappers and
+# going through add_run() for every segment.
+
+def _run_text(r):
+    # Mirrors python-docx's Run.text for the inner-content it translates.
+    parts = []
+    for e in r:
+        tag = e.tag
+        if tag == W_T:
+            parts.append(e.text or "")
+        elif tag == W_TAB or tag == W_PTAB:
+            parts.append("\t")
+        elif tag == W_CR:
+            parts.append("\n")
+        elif tag == W_BR:
+            if e.get(W_TYPE) in (None, "textWrapping"):
+                parts.append("\n")
+        elif tag == W_NO_BREAK_HYPHEN:
+            parts.append("-")
+    return "".join(parts)
+
+def _append_t(r, text):
+    t = r.makeelement(W_T, {})
+    t.text = text
+    if len(text.strip()) < len(text):
+        t.set(XML_SPACE, "preserve")
+    r.append(t)
+
+def _set_run_text(r, text):
+    # \t -> w:tab, \n/\r -> w:br, everything else batched into w:t
+    buf = []
+    for ch in text:
+        if ch == "\t" or ch in "\r\n":
+            if buf:
+                _append_t(r, "".join(buf))
+                buf = []
+            r.append(r.makeelement(W_TAB if ch == "\t" else W_BR, {}))
+        else:
+            buf.append(ch)
+    if buf:
+        _append_t(r, "".join(buf))
+
+def replace_placeholders_in_p_element(p, replacements):
+    runs = p.findall(W_R)
+    full_text = ''.join(_run_text(r) for r in runs)
+    if "{{" not in full_text:
+        return
+    segments = _placeholder_segments(full_text, replacements)
+    if segments is None:
+        return
+    for r in runs:
+        for child in list(r):
+            if child.tag != W_RPR:
+                r.remove(child)
+    for text, bold_flag in segments:
+        if not text:
+            continue
+        r = p.makeelement(W_R, {})
+        if bold_flag:
+            rpr = r.makeelement(W_RPR, {})
+            rpr.append(rpr.makeelement(W_B, {}))
+            r.append(rpr)
+        _set_run_text(r, text)
+        p.append(r)
+
+def replace_compiled_placeholders_lxml(doc, compiled, replacements):
+    roots = _part_roots(doc)
+    for partname, path, _ in compiled.targets:
+        replace_placeholders_in_p_element(_resolve_path(roots[partname], path), replacements)
+
+RENDER_ENGINES = {
+    "docx": replace_compiled_placeholders,
+    "lxml": replace_compiled_placeholders_lxml,
+}
+
+# ---------- Raw-XML stencil renderer ----------
+# For a fixed template only the text of the placeholder runs changes between
+# invoices. build_stencil renders the template once with a sentinel in place
+# of every placeholder (through the lxml engine, so bolding and run layout are
+# the same), serialises it, and splits each affected XML part at the
+# sentinels. Rendering an invoice is then a bytes join per part plus
+# re-emitting the untouched ZIP entries, which are compressed only once.
+#
+# Differences from the Document engines: a placeholder whose value is empty
+# keeps an empty run, and paragraphs are never dropped as trailing-empty
+# because of an empty value.
+
+SLOT_RE = re.compile(rb"@@INVOICE_SLOT_(\d+)@@")
+XML_BREAKS = {
+    "\t": "</w:t><w:tab/><w:t xml:space=\"preserve\">",
+    "\r": "</w:t><w:br/><w:t xml:space=\"preserve\">",
+    "\n": "</w:t><w:br/><w:t xml:space=\"preserve\">",
+}
+INVALID_XML_CHARS_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+def _slot_text(value):
+    if INVALID_XML_CHARS_RE.search(value):
+        raise ValueError(f"Replacement text is not XML compatible: {value!r}")
+    return xml_escape(value, XML_BREAKS).encode("utf-8")
+
+class XmlStencil:
+    def __init__(self, names, entries, compresslevel=1):
+        self.names = names
+        # PreparedEntry for untouched entries, (name, chunks, slots) for parts
+        # with placeholders: chunks[i] + value(slots[i]) + chunks[i + 1] ...
+        self.entries = entries
+        self.compresslevel = compresslevel
+
+    def render_part(self, chunks, slots, values):
+        out = [chunks[0]]
+        for name, chunk in zip(slots, chunks[1:]):
+            out.append(values[name])
+            out.append(chunk)
+        return b"".join(out)
+
+    def render(self, replacements):
+        values = {name: _slot_text(replacements.get(name, name)) for name in self.names}
+        zs = ZipStream()
+        out = []
+        for entry in self.entries:
+            if isinstance(entry, PreparedEntry):
+                out.append(zs.write_prepared(entry))
+            else:
+                name, chunks, slots = entry
+                out.append(zs.write_bytes(name, self.render_part(chunks, slots, values),
+                                          compresslevel=self.compresslevel))
+        out.append(zs.close())
+        return b"".join(out)
+
+def build_stencil(doc, compiled, compresslevel=1):
+    # `doc` is consumed: pass a private copy of the compiled template.
+    names = sorted(compiled.placeholders)
+    sentinels = {name: f"@@INVOICE_SLOT_{i}@@" for i, name in enumerate(names)}
+    replace_compiled_placeholders_lxml(doc, compiled, sentinels)
+    roots = _part_roots(doc)
+    for partname, path, _ in compiled.targets:
+        for t in _resolve_path(roots[partname], path).iter(W_T):
+            if t.text and "@@INVOICE_SLOT_" in t.text:
+                t.set(XML_SPACE, "preserve")
+    remove_trailing_empty_paragraphs(doc)
+    buf = BytesIO()
+    doc.save(buf)
+
+    dynamic = {partname.lstrip("/") for partname, _, _ in compiled.targets}
+    entries = []
+    with zipfile.ZipFile(buf) as zf:
+        for info in zf.infolist():
+            data = zf.read(info.filename)
+            if info.filename not in dynamic:
+                entries.append(PreparedEntry(info.filename, data))
+                continue
+            pieces = SLOT_RE.split(data)
+            slots = [names[int(i)] for i in pieces[1::2]]
+            entries.append((info.filename, pieces[0::2], slots))
+    return XmlStencil(names, entries, compresslevel)
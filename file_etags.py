@@ -0,0 +1,43 @@
+# file_etags.py
+# Strong ETags for files served from disk: a hash of the content, computed
+# once per file version. A version is (inode, mtime, size), so a rewritten
+# or replaced file gets hashed again and an unchanged one never is.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+CHUNK = 1024 * 1024
+
+class FileETags:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path -> (version, etag), LRU order
+
+    @staticmethod
+    def _hash(path):
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(CHUNK), b""):
+                h.update(chunk)
+        return h.hexdigest()[:32]
+
+    def get(self, path, st=None):
+        # -> ETag (without quotes) for `path`; pass its os.stat() result if
+        # the caller already has it.
+        st = st or os.stat(path)
+        version = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(path)
+                return entry[1]
+        # hash outside the lock; two threads may race to hash the same file
+        etag = self._hash(path)
+        with self._lock:
+            self._entries[path] = (version, etag)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag
@@ -0,0 +1,127 @@
+# invoice_registry.py
+# SQLite index of the invoice PDFs in OUTPUT_DIR, so listing a page of
+# invoices does not glob and regex the whole archive. The directory stays the
+# source of truth: the index is reconciled against it on startup and again
+# whenever the directory's mtime changes (files added or removed by hand).
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+INVOICE_NO_RE = re.compile(r"(GB-(\d{4})-(\d+))")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    filename   TEXT PRIMARY KEY,
+    invoice_no TEXT NOT NULL,
+    month_year TEXT,
+    suffix     INTEGER
+);
+CREATE INDEX IF NOT EXISTS invoices_month ON invoices (month_year, suffix);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def parse_invoice_filename(filename):
+    # -> (invoice_no, month_year, suffix); ("", None, None) when unnumbered
+    m = INVOICE_NO_RE.search(filename)
+    if not m:
+        return "", None, None
+    return m.group(1), m.group(2), int(m.group(3))
+
+class InvoiceRegistry:
+    def __init__(self, output_dir, db_path, suffix=".pdf", on_added=None):
+        self.output_dir = output_dir
+        self.db_path = db_path
+        self.suffix = suffix
+        # called with the new filenames whenever reconcile() finds some
+        self.on_added = on_added
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _row(self, filename):
+        invoice_no, month_year, suffix = parse_invoice_filename(filename)
+        return (filename, invoice_no, month_year, suffix)
+
+    # ---------- Keeping in sync ----------
+    def _scan(self):
+        names = set()
+        with os.scandir(self.output_dir) as it:
+            for entry in it:
+                if entry.name.endswith(self.suffix) and entry.is_file():
+                    names.add(entry.name)
+        return names
+
+    def reconcile(self):
+        with self._lock:
+            dir_mtime = os.stat(self.output_dir).st_mtime_ns
+            on_disk = self._scan()
+            with self._connect() as conn:
+                indexed = {name for (name,) in conn.execute("SELECT filename FROM invoices")}
+                added = on_disk - indexed
+                removed = indexed - on_disk
+                conn.executemany("INSERT OR REPLACE INTO invoices VALUES (?, ?, ?, ?)",
+                                 [self._row(name) for name in added])
+                conn.executemany("DELETE FROM invoices WHERE filename = ?", [(name,) for name in removed])
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('dir_mtime', ?)", (str(dir_mtime),))
+            self._dir_mtime = dir_mtime
+        if added or removed:
+            logger.info("Invoice index: %d added, %d removed", len(added), len(removed))
+        if added and self.on_added is not None:
+            self.on_added(added)
+
+    def reconcile_if_changed(self):
+        # One stat() per call. Another worker may already have reconciled, so
+        # compare against the mtime it recorded before rescanning.
+        dir_mtime = os.stat(self.output_dir).st_mtime_ns
+        if dir_mtime == self._dir_mtime:
+            return
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'dir_mtime'").fetchone()
+        if row and int(row[0]) == dir_mtime:
+            self._dir_mtime = dir_mtime
+            return
+        self.reconcile()
+
+    def add(self, filename):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO invoices VALUES (?, ?, ?, ?)", self._row(filename))
+
+    # ---------- Queries ----------
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def page(self, offset=0, limit=None):
+        # Newest first: same order as sorted(glob("*.pdf"), reverse=True)
+        sql = "SELECT filename, invoice_no FROM invoices ORDER BY filename DESC"
+        params = ()
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params = (limit, offset)
+        with self._connect() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def for_month(self, month_year):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT filename, invoice_no FROM invoices WHERE month_year = ? ORDER BY filename DESC",
+                (month_year,)).fetchall()
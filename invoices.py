@@ -0,0 +1,96 @@
+# invoices.py
+# Invoice maths and rendering shared by /generate, /generate-batch and the
+# batch CLI. Nothing here depends on Flask.
+import math
+from datetime import datetime
+from io import BytesIO
+
+from docx_render import RENDER_ENGINES, remove_trailing_empty_paragraphs
+from metrics import METRICS
+from utils import number_to_words_indian
+
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# "xml" renders through TemplateCache.stencil(); the rest go through a Document.
+ENGINE_NAMES = sorted(RENDER_ENGINES) + ["xml"]
+
+def month_year_for(date_value):
+    return datetime.strptime(date_value, "%Y-%m-%d").strftime("%m%y")
+
+def invoice_number(date_value, invoice_suffix):
+    return f"GB-{month_year_for(date_value)}-{invoice_suffix}"
+
+def docx_filename(invoice_no):
+    return f"G_BUILDCON_Invoice_{invoice_no}.docx"
+
+def pdf_filename(invoice_no):
+    return f"G_BUILDCON_Invoice_{invoice_no}.pdf"
+
+def build_replacements(y_value, date_value, invoice_no, payment_type, hsn_code):
+    sub_total = math.ceil(y_value * 1.02)
+    date_formatted = datetime.strptime(date_value, "%Y-%m-%d").strftime("%d/%m/%Y")
+
+    base_amount = sub_total / 1.18
+    cgst = base_amount * 0.09
+    sgst = base_amount * 0.09
+    sub_total_2 = base_amount + cgst + sgst
+    tax_total = cgst + sgst
+
+    sub_total_words = number_to_words_indian(sub_total)
+    tax_total_words = number_to_words_indian(tax_total)
+
+    return {
+        "{{BASE_TOTAL}}": f"{base_amount:.2f}",
+        "{{BASE_TO}}": f"{base_amount:.2f}",
+        "{{SUB_TOTAL}}": f"{sub_total:.2f}",
+        "{{TAX_TO_C}}": f"{tax_total:.2f}",
+        "{{SGST_C}}": f"{sgst:.2f}",
+        "{{CGST_C}}": f"{cgst:.2f}",
+        "{{base_amount}}": f"{base_amount:.2f}",
+        "{{base_amo}}": f"{base_amount:.2f}",
+        "{{cgst}}": f"{cgst:.2f}",
+        "{{sgst}}": f"{sgst:.2f}",
+        "{{tax_to}}": f"{tax_total:.2f}",
+        "{{cgst_c}}": f"{cgst:.2f}",
+        "{{sgst_c}}": f"{sgst:.2f}",
+        "{{tax_t}}": f"{tax_total:.2f}",
+        "{{sub_total}}": f"{sub_total_2:.2f}",
+        "{{sub_total_words}}": sub_total_words,
+        "{{tax_to_words}}": tax_total_words,
+        "{{date}}": date_formatted,
+        "{{invoice_no}}": invoice_no,
+        "{{payment_type}}": payment_type,
+        "{{hsn}}": hsn_code,
+        "{{hsn_1}}": hsn_code,
+        "{{hsn_n}}": hsn_code,
+    }
+
+def render_docx(cache, engine, replacements, render_cache=None):
+    # DOCX bytes for `replacements` rendered from the template in `cache`;
+    # with a RenderCache, identical requests are served from it.
+    if render_cache is not None:
+        key = render_cache.key(f"docx:{engine}", cache.version, replacements)
+        return render_cache.get_or_render(key, lambda: render_docx(cache, engine, replacements))
+    if engine == "xml":
+        with METRICS.stage("invoice_stage_seconds", operation="render_docx", stage="stencil"):
+            return cache.stencil().render(replacements)
+    with METRICS.stage("invoice_stage_seconds", operation="render_docx", stage="template"):
+        doc, compiled = cache.get()
+    with METRICS.stage("invoice_stage_seconds", operation="render_docx", stage="substitute"):
+        RENDER_ENGINES[engine](doc, compiled, replacements)
+        remove_trailing_empty_paragraphs(doc)
+    with METRICS.stage("invoice_stage_seconds", operation="render_docx", stage="serialize"):
+        buf = BytesIO()
+        doc.save(buf)
+    return buf.getvalue()
+
+def render_pdf(cache, replacements, render_cache=None):
+    # PDF bytes drawn straight from the template's compiled page layout,
+    # without going through a DOCX (see pdf_render.py).
+    if render_cache is not None:
+        key = render_cache.key("pdf", cache.version, replacements)
+        return render_cache.get_or_render(key, lambda: render_pdf(cache, replacements))
+    with METRICS.stage("invoice_stage_seconds", operation="render_pdf", stage="layout"):
+        layout = cache.pdf_layout()
+    with METRICS.stage("invoice_stage_seconds", operation="render_pdf", stage="draw"):
+        return layout.render(replacements)
@@ -0,0 +1,207 @@
+# metrics.py
+# Hot-path timings and counters, exported in the Prometheus text format.
+# Disabled (the default), every call is one flag check: stage() hands back a
+# shared no-op context manager and inc()/observe() return at once.
+#
+# Under a pre-fork server each worker only sees its own numbers, so with a
+# directory configured every process also writes a snapshot there (at most
+# every `flush_interval` seconds, from a background thread) and render()
+# sums the snapshots of the other processes with its own live numbers.
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL = nullcontext()
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    def escape(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.directory = None
+        self.flush_interval = 5
+        self._lock = threading.Lock()
+        self._help = {}        # name -> (type, help)
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [per-bucket counts..., +Inf, sum, count]
+        self._flusher_pid = None
+
+    def configure(self, enabled, directory=None, flush_interval=5):
+        # Clears the snapshots of processes from an earlier run. Those of
+        # live processes stay: importing the app elsewhere (batch.py,
+        # bench.py) must not wipe a running server's numbers.
+        self.enabled = enabled
+        self.directory = directory if enabled else None
+        self.flush_interval = flush_interval
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                pid = os.path.basename(path)[:-len(".json")]
+                if pid.isdigit() and _alive(int(pid)):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    # ---------- Recording ----------
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._ensure_flusher()
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(BUCKETS) + 3)
+            h[bisect.bisect_left(BUCKETS, seconds)] += 1
+            h[-2] += seconds
+            h[-1] += 1
+        self._ensure_flusher()
+
+    def stage(self, name, **labels):
+        # with METRICS.stage("invoice_stage_seconds", operation=..., stage=...):
+        if not self.enabled:
+            return _NULL
+        return _Timer(self, name, labels)
+
+    # ---------- Sharing between processes ----------
+    def _ensure_flusher(self):
+        # One flusher thread per process, started after the fork
+        if self.directory is None or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, labels, value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, labels, list(h)] for (name, labels), h in self._histograms.items()],
+            }
+
+    def flush(self):
+        if self.directory is None:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as fh:
+            json.dump(self._snapshot(), fh)
+        os.replace(path + ".tmp", path)
+
+    def _collect(self):
+        counters, histograms = {}, {}
+        snapshots = [self._snapshot()]
+        if self.directory:
+            own = os.path.join(self.directory, f"{os.getpid()}.json")
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as fh:
+                        snapshots.append(json.load(fh))
+                except (OSError, ValueError):
+                    continue  # replaced while we read it
+        for snap in snapshots:
+            for name, labels, value in snap["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, h in snap["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(h))
+                for i, v in enumerate(h):
+                    total[i] += v
+        return counters, histograms
+
+    # ---------- Export ----------
+    def render(self):
+        counters, histograms = self._collect()
+        lines = []
+        described = set()
+        def header(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            kind, help_text = self._help.get(name, (kind, ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), h in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for le, count in zip(BUCKETS + ("+Inf",), h):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{le}'),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {h[-2]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+# The process-wide instance; app.py configures it.
+METRICS = Metrics()
+METRICS.describe("invoice_stage_seconds", "histogram", "Time spent in each stage of an operation")
+METRICS.describe("http_request_seconds", "histogram", "Request handling time per endpoint")
+METRICS.describe("http_requests_total", "counter", "Requests per endpoint and status")
+METRICS.describe("invoices_generated_total", "counter", "Invoice files written, by format")
+METRICS.describe("render_cache_requests_total", "counter", "Render cache lookups, by result")
+METRICS.describe("totp_verifications_total", "counter", "TOTP codes checked, by result")
+METRICS.describe("errors_total", "counter", "Failures, by operation")
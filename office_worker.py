@@ -0,0 +1,77 @@
+# office_worker.py
+# Helper process for pdf_convert.py. It connects over UNO to one headless
+# soffice listening on a named pipe and converts documents to PDF on request,
+# so the office is started once rather than per file. Runs under an
+# interpreter that can import `uno` (LibreOffice's bundled python, or the
+# system python3 with python3-uno), which need not be the app's interpreter.
+#
+#   python office_worker.py <pipe-name> [startup-timeout]
+#
+# stdin:  one JSON object per line, {"src": "/abs/in.docx", "dst": "/abs/out.pdf"}
+#         or {"quit": true}
+# stdout: "ready" once connected, then one JSON object per job, {"ok": true}
+#         or {"ok": false, "error": "..."}
+import json
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+def _props(**kwargs):
+    return tuple(PropertyValue(Name=k, Value=v) for k, v in kwargs.items())
+
+def connect(pipe_name, timeout):
+    local = uno.getComponentContext()
+    resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+    url = "uno:pipe,name=%s;urp;StarOffice.ComponentContext" % pipe_name
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            ctx = resolver.resolve(url)
+            break
+        except NoConnectException:
+            # soffice is still starting
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+    return ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+
+def convert(desktop, src, dst):
+    doc = desktop.loadComponentFromURL(uno.systemPathToFileUrl(src), "_blank", 0, _props(Hidden=True))
+    if doc is None:
+        raise RuntimeError("could not load %s" % src)
+    try:
+        doc.storeToURL(uno.systemPathToFileUrl(dst), _props(FilterName="writer_pdf_Export"))
+    finally:
+        doc.close(True)
+
+def reply(obj):
+    sys.stdout.write(json.dumps(obj) + "\n")
+    sys.stdout.flush()
+
+def main(argv):
+    pipe_name = argv[1]
+    timeout = float(argv[2]) if len(argv) > 2 else 30
+    desktop = connect(pipe_name, timeout)
+    sys.stdout.write("ready\n")
+    sys.stdout.flush()
+    for line in sys.stdin:
+        job = json.loads(line)
+        if job.get("quit"):
+            try:
+                desktop.terminate()
+            except Exception:
+                pass  # the bridge drops as soffice exits
+            break
+        try:
+            convert(desktop, job["src"], job["dst"])
+        except Exception as e:
+            reply({"ok": False, "error": "%s: %s" % (type(e).__name__, e)})
+        else:
+            reply({"ok": True})
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
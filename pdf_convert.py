@@ -0,0 +1,222 @@
+# pdf_convert.py
+# DOCX -> PDF through a pool of long-lived headless LibreOffice processes.
+# Launching soffice per file costs seconds; here each pool worker is one
+# soffice (own profile, listening on a named pipe) plus an office_worker.py
+# helper that drives it over UNO. Workers are started on first use, replaced
+# after `recycle_after` jobs (soffice grows over time) and killed and
+# replaced when a job exceeds `timeout`.
+import atexit
+import importlib.util
+import json
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+HELPER = str(Path(__file__).with_name("office_worker.py"))
+STARTUP_TIMEOUT = 60
+
+class ConversionError(Exception):
+    pass
+
+class ConversionTimeout(ConversionError):
+    pass
+
+def find_soffice(name=None):
+    for candidate in ([name] if name else ["soffice", "libreoffice"]):
+        path = shutil.which(candidate)
+        if path:
+            return path
+    return None
+
+def find_office_python(soffice):
+    # An interpreter that can import `uno`: ours if python3-uno is
+    # installed for it, otherwise the one LibreOffice bundles.
+    if importlib.util.find_spec("uno") is not None:
+        return sys.executable
+    bundled = Path(os.path.realpath(soffice)).with_name("python")
+    if bundled.exists():
+        return str(bundled)
+    return sys.executable
+
+def _kill_group(proc):
+    if proc is None or proc.poll() is not None:
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    proc.wait()
+
+class OfficeWorker:
+    # One soffice and its UNO helper. Not thread-safe; the pool hands each
+    # worker to one thread at a time.
+    def __init__(self, index, soffice, python):
+        self.index = index
+        self.soffice = soffice
+        self.python = python
+        self.jobs = 0
+        self._generation = 0
+        self._office = None
+        self._helper = None
+        self._lines = None
+        self._profile = None
+
+    @property
+    def running(self):
+        return self._helper is not None and self._helper.poll() is None
+
+    def start(self):
+        self._generation += 1
+        pipe_name = f"invoice_office_{os.getpid()}_{self.index}_{self._generation}"
+        self._profile = tempfile.mkdtemp(prefix="invoice-office-")
+        # own session so the whole soffice -> soffice.bin tree can be killed
+        self._office = subprocess.Popen(
+            [self.soffice, "--headless", "--invisible", "--nologo", "--norestore", "--nodefault",
+             "--nolockcheck", f"-env:UserInstallation={Path(self._profile).as_uri()}",
+             f"--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext"],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True)
+        self._helper = subprocess.Popen(
+            [self.python, HELPER, pipe_name, str(STARTUP_TIMEOUT)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1,
+            start_new_session=True)
+        # readline() cannot time out, so a thread feeds the helper's output
+        # into a queue that can
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_lines, args=(self._helper.stdout, self._lines),
+                         daemon=True).start()
+        self.jobs = 0
+        try:
+            ready = self._read(STARTUP_TIMEOUT)
+        except ConversionTimeout:
+            ready = None
+        if ready != "ready":
+            # both run in their own session: kill them, or they outlive us
+            self.stop(graceful=False)
+            raise ConversionError(f"office worker {self.index} failed to start within {STARTUP_TIMEOUT}s")
+        logger.info("Office worker %d started (soffice pid %d)", self.index, self._office.pid)
+
+    @staticmethod
+    def _read_lines(stream, lines):
+        for line in stream:
+            lines.put(line.rstrip("\n"))
+        lines.put(None)  # EOF: the helper exited
+
+    def _read(self, timeout):
+        try:
+            return self._lines.get(timeout=timeout)
+        except queue.Empty:
+            raise ConversionTimeout(f"office worker {self.index} did not answer within {timeout}s")
+
+    def convert(self, src, dst, timeout):
+        if not self.running:
+            self.start()
+        self.jobs += 1
+        try:
+            self._helper.stdin.write(json.dumps({"src": os.path.abspath(src), "dst": os.path.abspath(dst)}) + "\n")
+            self._helper.stdin.flush()
+            line = self._read(timeout)
+        except (OSError, ConversionTimeout):
+            self.stop()
+            raise
+        if line is None:
+            self.stop()
+            raise ConversionError(f"office worker {self.index} exited during conversion")
+        result = json.loads(line)
+        if not result["ok"]:
+            raise ConversionError(result["error"])
+
+    def stop(self, graceful=True):
+        if graceful and self.running:
+            try:
+                self._helper.stdin.write(json.dumps({"quit": True}) + "\n")
+                self._helper.stdin.flush()
+                self._helper.wait(timeout=5)
+                self._office.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        _kill_group(self._helper)
+        _kill_group(self._office)
+        self._helper = self._office = None
+        if self._profile:
+            shutil.rmtree(self._profile, ignore_errors=True)
+            self._profile = None
+
+class ConversionPool:
+    def __init__(self, size=2, timeout=60, recycle_after=200, soffice=None, python=None):
+        self.size = size
+        self.timeout = timeout
+        self.recycle_after = recycle_after
+        self.soffice = find_soffice(soffice)
+        if self.soffice is None:
+            raise ConversionError("LibreOffice (soffice) not found")
+        self.python = python or find_office_python(self.soffice)
+        self._idle = queue.Queue()
+        for i in range(size):
+            self._idle.put(OfficeWorker(i, self.soffice, self.python))
+        # the pool threads only wait on their worker, one thread per worker
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="pdf-convert")
+        self._closed = False
+        atexit.register(self.close)
+
+    def warm_up(self):
+        # Start every worker now rather than on its first job
+        workers = [self._idle.get() for _ in range(self.size)]
+        try:
+            for worker in workers:
+                if not worker.running:
+                    worker.start()
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    def convert(self, src, dst):
+        # Blocking. The PDF is written next to `dst` and renamed into place,
+        # so a half-written file is never listed.
+        part = f"{dst}.part"
+        worker = self._idle.get()
+        try:
+            worker.convert(src, part, self.timeout)
+            os.replace(part, dst)
+        finally:
+            if worker.running and worker.jobs >= self.recycle_after:
+                logger.info("Recycling office worker %d after %d jobs", worker.index, worker.jobs)
+                worker.stop()
+            self._idle.put(worker)
+            if os.path.exists(part):
+                os.remove(part)
+        return dst
+
+    def submit(self, src, dst, on_done=None, on_start=None):
+        # -> Future for convert(). Both callbacks run in the pool thread:
+        # `on_start()` when a worker picks the job up, `on_done(dst)` once
+        # the PDF is in place.
+        def job():
+            if on_start is not None:
+                on_start()
+            self.convert(src, dst)
+            if on_done is not None:
+                on_done(dst)
+            return dst
+        return self._executor.submit(job)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
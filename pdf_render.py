@@ -0,0 +1,667 @@
+# pdf_render.py
+# Draws the invoice straight to PDF, without a DOCX or an office suite.
+#
+# compile_pdf_layout() reads the template once: page size and margins,
+# tables (grid columns, spans, vertical merges, borders, row heights),
+# paragraphs with their run formatting, and the inline logo. Paragraphs
+# without placeholders are wrapped into positioned lines there and then, and
+# fonts and images become finished PDF objects. PdfLayout.render() only wraps
+# the placeholder paragraphs, sizes the rows and writes the page.
+#
+# Approximations: text uses the standard PDF fonts (Helvetica for Arial,
+# Calibri/Aptos and Trebuchet, Times for Times New Roman) in WinAnsi
+# encoding, so nothing is embedded and "₹" is drawn as "Rs."; custom tab stops,
+# character spacing, headers/footers and rows split across pages are not
+# reproduced. python bench.py --pdf-diff compares the result with a PDF saved
+# from Word.
+import re
+import zlib
+
+from docx_render import (
+    W_BR, W_CR, W_NO_BREAK_HYPHEN, W_P, W_PTAB, W_R, W_RPR, W_T, W_TAB, W_TYPE,
+    _placeholder_segments, _run_text, _w,
+)
+
+W_TBL, W_TR, W_TC, W_PPR, W_TCPR, W_TRPR, W_TBLPR = _w("tbl"), _w("tr"), _w("tc"), _w("pPr"), _w("tcPr"), _w("trPr"), _w("tblPr")
+W_VAL = _w("val")
+A_BLIP = "{http://schemas.openxmlformats.org/drawingml/2006/main}blip"
+WP_EXTENT = "{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}extent"
+R_EMBED = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
+W_DRAWING = _w("drawing")
+
+TWIP = 1 / 20.0       # twentieths of a point
+EMU = 1 / 12700.0     # drawing units
+DEFAULT_TAB = 36.0    # Word's default 0.5" tab grid
+DESCENT = 0.22        # baseline above the bottom of a line, in em
+
+# Word font -> (serif?, width relative to the PDF font, single line height in em)
+FACES = {
+    "Times New Roman": (True, 1.0, 1.15),
+    "Arial": (False, 1.0, 1.15),
+    "Trebuchet MS": (False, 0.97, 1.16),
+    "Calibri": (False, 0.88, 1.22),
+    "Aptos": (False, 0.92, 1.22),
+}
+DEFAULT_FACE = (False, 1.0, 1.15)
+
+# ---------- Fonts ----------
+def _widths(spec):
+    widths = [int(w) for w in spec.split()]
+    assert len(widths) == 95
+    return widths
+
+# Advance widths (1/1000 em) of ' '..'~' from the standard 14 font AFMs
+ASCII_WIDTHS = {
+    "Helvetica": _widths("""
+        278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278
+        556 556 556 556 556 556 556 556 556 556 278 278 584 584 584 556 1015
+        667 667 722 722 667 611 778 722 278 500 667 556 833 722 778 667 778 722 667 611 722 667 944 667 667 611
+        278 278 278 469 556 333
+        556 556 500 556 556 278 556 556 222 222 500 222 833 556 556 556 556 333 500 278 556 500 722 500 500 500
+        334 260 334 584"""),
+    "Helvetica-Bold": _widths("""
+        278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278
+        556 556 556 556 556 556 556 556 556 556 333 333 584 584 584 611 975
+        722 722 722 722 667 611 778 722 278 556 722 611 833 722 778 667 778 722 667 611 722 667 944 667 667 611
+        333 278 333 584 556 333
+        556 611 556 611 556 333 611 611 278 278 556 278 889 611 611 611 611 389 556 333 611 556 778 556 556 500
+        389 280 389 584"""),
+    "Times-Roman": _widths("""
+        250 333 408 500 500 833 778 180 333 333 500 564 250 333 250 278
+        500 500 500 500 500 500 500 500 500 500 278 278 564 564 564 444 921
+        722 667 667 722 611 556 722 722 333 389 722 611 889 722 722 556 722 667 556 611 722 722 944 722 722 611
+        333 278 333 469 500 333
+        444 500 444 500 444 333 500 500 278 278 500 278 778 500 500 500 500 333 389 278 500 500 722 500 500 444
+        480 200 480 541"""),
+    "Times-Bold": _widths("""
+        250 333 555 500 500 1000 833 278 333 333 500 570 250 333 250 278
+        500 500 500 500 500 500 500 500 500 500 333 333 570 570 570 500 930
+        722 667 722 722 667 611 778 778 389 500 778 667 944 722 778 611 778 722 556 667 722 722 1000 722 722 667
+        333 278 333 581 500 333
+        500 556 444 556 444 333 500 556 278 333 556 278 833 556 500 556 556 444 389 333 556 500 722 500 500 444
+        394 220 394 520"""),
+}
+
+# WinAnsi bytes above 0x7E that invoices actually contain
+HIGH_WIDTHS = {
+    0x91: (222, 278, 333, 333), 0x92: (222, 278, 333, 333),     # quotes
+    0x93: (333, 500, 444, 500), 0x94: (333, 500, 444, 500),
+    0x96: (556, 556, 500, 500), 0x97: (1000, 1000, 1000, 1000),  # dashes
+    0xA0: (278, 278, 250, 250), 0xA9: (737, 737, 760, 747),      # nbsp, (c)
+}
+
+FONT_RESOURCES = {"Helvetica": b"F1", "Helvetica-Bold": b"F2", "Times-Roman": b"F3", "Times-Bold": b"F4"}
+
+def _width_table(i, name):
+    table = [ASCII_WIDTHS[name][0]] * 32
+    table += ASCII_WIDTHS[name]
+    table += [556 if name.startswith("Helvetica") else 500] * (256 - len(table))
+    for byte, widths in HIGH_WIDTHS.items():
+        table[byte] = widths[i]
+    return table
+
+WIDTH_TABLES = {name: _width_table(i, name) for i, name in enumerate(FONT_RESOURCES)}
+
+def font_name(serif, bold):
+    if serif:
+        return "Times-Bold" if bold else "Times-Roman"
+    return "Helvetica-Bold" if bold else "Helvetica"
+
+def winansi(text):
+    return text.replace("₹", "Rs.").encode("cp1252", "replace")
+
+def text_width(data, font, size):
+    table = WIDTH_TABLES[font]
+    return sum(table[b] for b in data) * size / 1000.0
+
+def _pdf_string(data):
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+def _color(value):
+    if not value or value == "auto" or not re.fullmatch(r"[0-9A-Fa-f]{6}", value):
+        return (0.0, 0.0, 0.0)
+    return tuple(int(value[i:i + 2], 16) / 255.0 for i in (0, 2, 4))
+
+# ---------- Images ----------
+def _jpeg_size(data):
+    # -> (width, height, components) from the first SOF marker
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            raise ValueError("not a JPEG")
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height, data[i + 9]
+        i += 2 + length
+    raise ValueError("JPEG without a frame header")
+
+def _image_object(data):
+    # -> PDF image XObject body. JPEGs are passed through; anything else is
+    # decoded with Pillow (imported only if the template needs it).
+    colorspaces = {1: b"/DeviceGray", 3: b"/DeviceRGB", 4: b"/DeviceCMYK"}
+    if data[:2] == b"\xff\xd8":
+        width, height, components = _jpeg_size(data)
+        header = b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s " \
+                 b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>" % (
+                     width, height, colorspaces[components], len(data))
+        return header + b"\nstream\n" + data + b"\nendstream"
+    from io import BytesIO
+    from PIL import Image
+    img = Image.open(BytesIO(data)).convert("RGB")
+    raw = zlib.compress(img.tobytes())
+    header = b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB " \
+             b"/BitsPerComponent 8 /Filter /FlateDecode /Length %d >>" % (img.width, img.height, len(raw))
+    return header + b"\nstream\n" + raw + b"\nendstream"
+
+# ---------- Paragraph layout ----------
+TOKEN_RE = re.compile(r"\n|\t|[^\S\n\t]+|[^\s]+")
+
+# A run style is (pdf font, size, (r, g, b), width scale, character spacing,
+# line height in em).
+
+def bold_style(style, bold):
+    font = style[0]
+    serif = font.startswith("Times")
+    return (font_name(serif, bold),) + style[1:]
+
+class Para:
+    def __init__(self, items, jc, ind_left, ind_right, after, factor, mark_style, base_style, slot=None):
+        # items: [("text", str, style) | ("img", name, w, h)]
+        self.items = items
+        self.jc = jc
+        self.ind_left = ind_left
+        self.ind_right = ind_right
+        self.after = after
+        self.factor = factor
+        # paragraph mark: sizes empty lines and restyled placeholder runs
+        self.mark_style = mark_style
+        self.base_style = base_style  # a run without formatting
+        # joined run text when the paragraph has placeholders, else None
+        self.slot = slot
+        self.lines = None  # pre-wrapped (lines, height) for static paragraphs
+
+    def items_for(self, replacements):
+        if self.slot is None:
+            return self.items
+        # Same runs as the DOCX engines produce: no run formatting of their
+        # own, bold per _placeholder_segments
+        segments = _placeholder_segments(self.slot, replacements) or [(self.slot, False)]
+        return [("text", text, bold_style(self.base_style, bold)) for text, bold in segments if text]
+
+def layout_paragraph(para, items, width):
+    # -> ([(line height, baseline offset, [fragment, ...]), ...], height)
+    # fragment: ("T", x, bytes, style) | ("I", x, w, h, name)
+    avail = max(width - para.ind_left - para.ind_right, 1.0)
+    lines = []
+    frags, x, style = [], 0.0, None   # style: the tallest run on the line
+
+    def finish():
+        nonlocal frags, x, style
+        while frags and frags[-1][0] == "S":
+            frags.pop()
+        used = max((f[1] + f[2] for f in frags), default=0.0)
+        shift = para.ind_left
+        if para.jc == "center":
+            shift += (avail - used) / 2
+        elif para.jc in ("right", "end"):
+            shift += avail - used
+        size, line = (style or para.mark_style)[1], (style or para.mark_style)[5]
+        height = size * line * para.factor
+        image_height = max((f[3] for f in frags if f[0] == "I"), default=0.0)
+        height = max(height, image_height + size * DESCENT)
+        baseline = max(size * (line - DESCENT), image_height)
+        out = []
+        for f in frags:
+            if f[0] == "T":
+                out.append(("T", f[1] + shift, f[3], f[4]))
+            elif f[0] == "I":
+                out.append(("I", f[1] + shift, f[2], f[3], f[4]))
+        lines.append((height, baseline, out))
+        frags, x, style = [], 0.0, None
+
+    def taller(run_style):
+        if style is None or run_style[1] * run_style[5] > style[1] * style[5]:
+            return run_style
+        return style
+
+    for item in items:
+        if item[0] == "img":
+            _, name, w, h = item
+            if frags and x + w > avail:
+                finish()
+            frags.append(("I", x, w, h, name))
+            x += w
+            continue
+        _, text, run_style = item
+        font, fsize, _, scale, spacing, _ = run_style
+        for m in TOKEN_RE.finditer(text):
+            token = m.group()
+            if token == "\n":
+                style = taller(run_style)
+                finish()
+            elif token == "\t":
+                x = (int(x / DEFAULT_TAB) + 1) * DEFAULT_TAB
+                style = taller(run_style)
+            else:
+                data = winansi(token)
+                w = text_width(data, font, fsize) * scale + spacing * len(data)
+                if token.isspace():
+                    # kept at the start of a paragraph, dropped at line ends
+                    frags.append(("S", x, w))
+                    x += w
+                    continue
+                if frags and x + w > avail:
+                    finish()
+                frags.append(("T", x, w, data, run_style))
+                x += w
+                style = taller(run_style)
+    if frags or not lines:
+        finish()
+    height = sum(line[0] for line in lines) + para.after
+    return lines, height
+
+# ---------- Tables ----------
+class Cell:
+    def __init__(self, col, span, vmerge, paras, borders):
+        self.col = col
+        self.span = span
+        self.vmerge = vmerge     # "restart", "continue" or None
+        self.paras = paras
+        self.borders = borders   # (top, left, bottom, right) line widths, 0 = none
+        self.width = 0.0
+
+class Row:
+    def __init__(self, cells, height, exact):
+        self.cells = cells
+        self.height = height
+        self.exact = exact
+
+class Table:
+    def __init__(self, columns, rows, margin):
+        self.columns = columns
+        self.rows = rows
+        self.margin = margin     # left/right cell padding
+
+# ---------- Compile ----------
+def _bool_prop(rpr, tag):
+    el = rpr.find(_w(tag)) if rpr is not None else None
+    return el is not None and el.get(W_VAL) not in ("0", "false", "off")
+
+def _child_val(parent, *tags):
+    el = parent
+    for tag in tags:
+        if el is None:
+            return None
+        el = el.find(_w(tag))
+    return el.get(W_VAL) if el is not None else None
+
+def _font_family(rpr, theme_fonts):
+    fonts = rpr.find(_w("rFonts")) if rpr is not None else None
+    if fonts is None:
+        return None
+    if fonts.get(_w("ascii")):
+        return fonts.get(_w("ascii"))
+    theme = fonts.get(_w("asciiTheme"))
+    if theme:
+        return theme_fonts.get("major" if theme.startswith("major") else "minor")
+    return None
+
+def _run_style(rpr, default_size, default_family, theme_fonts):
+    size = _child_val(rpr, "sz")
+    spacing = _child_val(rpr, "spacing")
+    serif, scale, line = FACES.get(_font_family(rpr, theme_fonts) or default_family, DEFAULT_FACE)
+    return (font_name(serif, _bool_prop(rpr, "b")),
+            int(size) / 2.0 if size else default_size,
+            _color(_child_val(rpr, "color")),
+            scale,
+            int(spacing) * TWIP if spacing else 0.0,
+            line)
+
+def _border_width(borders, side):
+    el = borders.find(_w(side)) if borders is not None else None
+    if el is None:
+        return None
+    if el.get(W_VAL) in ("nil", "none"):
+        return 0.0
+    return int(el.get(_w("sz"), "4")) / 8.0
+
+class _Compiler:
+    def __init__(self, doc):
+        self.doc = doc
+        styles = doc.styles.element
+        defaults = styles.find(_w("docDefaults"))
+        rpr = defaults.find(f"{_w('rPrDefault')}/{W_RPR}") if defaults is not None else None
+        ppr = defaults.find(f"{_w('pPrDefault')}/{W_PPR}") if defaults is not None else None
+        size = _child_val(rpr, "sz")
+        self.default_size = int(size) / 2.0 if size else 11.0
+        self.theme_fonts = self._theme_fonts()
+        self.default_family = _font_family(rpr, self.theme_fonts)
+        self.base_style = self.run_style(None)
+        self.default_spacing = self._spacing(ppr, (0.0, 1.0))
+        self.styles = {s.get(_w("styleId")): s for s in styles.findall(_w("style"))}
+        self.images = {}   # relationship id -> (resource name, object body)
+
+    def _theme_fonts(self):
+        # {"minor": "Aptos", "major": ...} from the theme part, if any
+        from lxml import etree
+        a = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+        for rel in self.doc.part.rels.values():
+            if rel.reltype.endswith("/theme") and not rel.is_external:
+                theme = etree.fromstring(rel.target_part.blob)
+                fonts = {}
+                for kind in ("minor", "major"):
+                    latin = theme.find(f".//{a}{kind}Font/{a}latin")
+                    if latin is not None:
+                        fonts[kind] = latin.get("typeface")
+                return fonts
+        return {}
+
+    def run_style(self, rpr):
+        return _run_style(rpr, self.default_size, self.default_family, self.theme_fonts)
+
+    def _spacing(self, ppr, inherited):
+        el = ppr.find(_w("spacing")) if ppr is not None else None
+        after, factor = inherited
+        if el is not None:
+            if el.get(_w("after")) is not None:
+                after = int(el.get(_w("after"))) * TWIP
+            if el.get(_w("line")) is not None and el.get(_w("lineRule"), "auto") == "auto":
+                factor = int(el.get(_w("line"))) / 240.0
+        return after, factor
+
+    def image(self, r_id):
+        if r_id not in self.images:
+            blob = self.doc.part.related_parts[r_id].blob
+            self.images[r_id] = (f"Im{len(self.images) + 1}".encode(), _image_object(blob))
+        return self.images[r_id][0]
+
+    def paragraph(self, p, spacing):
+        ppr = p.find(W_PPR)
+        jc = _child_val(ppr, "jc") or "left"
+        ind = ppr.find(_w("ind")) if ppr is not None else None
+        ind_left = int(ind.get(_w("left"), ind.get(_w("start"), "0"))) * TWIP if ind is not None else 0.0
+        ind_right = int(ind.get(_w("right"), ind.get(_w("end"), "0"))) * TWIP if ind is not None else 0.0
+        after, factor = self._spacing(ppr, spacing)
+        mark_style = self.run_style(ppr.find(W_RPR) if ppr is not None else None)
+        runs = p.findall(W_R)
+        full_text = "".join(_run_text(r) for r in runs)
+        slot = full_text if "{{" in full_text and _placeholder_segments(full_text, {}) is not None else None
+        items = []
+        for r in runs:
+            style = self.run_style(r.find(W_RPR))
+            for e in r:
+                tag = e.tag
+                text = None
+                if tag == W_T:
+                    text = e.text or ""
+                elif tag in (W_TAB, W_PTAB):
+                    text = "\t"
+                elif tag == W_CR or (tag == W_BR and e.get(W_TYPE) in (None, "textWrapping")):
+                    text = "\n"
+                elif tag == W_NO_BREAK_HYPHEN:
+                    text = "-"
+                elif tag == W_DRAWING:
+                    blip = next(e.iter(A_BLIP), None)
+                    extent = next(e.iter(WP_EXTENT), None)
+                    if blip is not None and extent is not None:
+                        items.append(("img", self.image(blip.get(R_EMBED)),
+                                      int(extent.get("cx")) * EMU, int(extent.get("cy")) * EMU))
+                if text:
+                    items.append(("text", text, style))
+        return Para(items, jc, ind_left, ind_right, after, factor, mark_style, self.base_style, slot)
+
+    def table(self, tbl):
+        tblpr = tbl.find(W_TBLPR)
+        style = self.styles.get(_child_val(tblpr, "tblStyle"))
+        style_borders = style.find(f"{W_TBLPR}/{_w('tblBorders')}") if style is not None else None
+        table_borders = tblpr.find(_w("tblBorders")) if tblpr is not None else None
+        spacing = self._spacing(style.find(W_PPR) if style is not None else None, self.default_spacing)
+
+        def default_border(side):
+            for borders in (table_borders, style_borders):
+                width = _border_width(borders, side)
+                if width is not None:
+                    return width
+            return 0.0
+
+        columns = [int(c.get(_w("w"))) * TWIP for c in tbl.find(_w("tblGrid")).findall(_w("gridCol"))]
+        trs = tbl.findall(W_TR)
+        rows = []
+        for ri, tr in enumerate(trs):
+            trpr = tr.find(W_TRPR)
+            height_el = trpr.find(_w("trHeight")) if trpr is not None else None
+            height = int(height_el.get(W_VAL, "0")) * TWIP if height_el is not None else 0.0
+            exact = height_el is not None and height_el.get(_w("hRule")) == "exact"
+            cells = []
+            col = 0
+            tcs = tr.findall(W_TC)
+            for ci, tc in enumerate(tcs):
+                tcpr = tc.find(W_TCPR)
+                span = int(_child_val(tcpr, "gridSpan") or 1)
+                vmerge_el = tcpr.find(_w("vMerge")) if tcpr is not None else None
+                vmerge = None if vmerge_el is None else (vmerge_el.get(W_VAL) or "continue")
+                tc_borders = tcpr.find(_w("tcBorders")) if tcpr is not None else None
+                borders = []
+                for side, outer in (("top", ri == 0), ("left", ci == 0),
+                                    ("bottom", ri == len(trs) - 1), ("right", ci == len(tcs) - 1)):
+                    width = _border_width(tc_borders, side)
+                    if width is None:
+                        width = default_border(side if outer else
+                                               ("insideH" if side in ("top", "bottom") else "insideV"))
+                    borders.append(width)
+                paras = [self.paragraph(p, spacing) for p in tc.findall(W_P)]
+                cells.append(Cell(col, span, vmerge, paras, tuple(borders)))
+                col += span
+            rows.append(Row(cells, height, exact))
+        margin = self._cell_margin(style)
+        table = Table(columns, rows, margin)
+        for row in rows:
+            for cell in row.cells:
+                cell.width = sum(columns[cell.col:cell.col + cell.span]) - 2 * margin
+                for para in cell.paras:
+                    if para.slot is None:
+                        para.lines = layout_paragraph(para, para.items, cell.width)
+        return table
+
+    def _cell_margin(self, style):
+        # left cell margin from the table style (or its base), default 0.08"
+        seen = 0
+        while style is not None and seen < 10:
+            mar = style.find(f"{W_TBLPR}/{_w('tblCellMar')}/{_w('left')}")
+            if mar is not None:
+                return int(mar.get(_w("w"))) * TWIP
+            style = self.styles.get(_child_val(style, "basedOn"))
+            seen += 1
+        return 108 * TWIP
+
+class PdfLayout:
+    def __init__(self, page_size, margins, blocks, static_objects, resources):
+        self.page_size = page_size      # (width, height)
+        self.margins = margins          # (top, right, bottom, left)
+        self.blocks = blocks            # Para | Table, in body order
+        self.static_objects = static_objects
+        self.resources = resources
+
+    # ---------- Rendering ----------
+    def render(self, replacements):
+        pages = [[]]
+        page_w, page_h = self.page_size
+        top, right, bottom, left = self.margins
+        width = page_w - left - right
+        y = page_h - top
+
+        def new_page():
+            pages.append([])
+            return page_h - top
+
+        for block in self.blocks:
+            if isinstance(block, Para):
+                lines, height = block.lines or layout_paragraph(block, block.items_for(replacements), width)
+                if y - height < bottom and y < page_h - top:
+                    y = new_page()
+                self._draw_lines(pages[-1], lines, left, y)
+                y -= height
+            else:
+                y = self._draw_table(block, replacements, left, y, bottom, pages, new_page)
+        return self._document([b"".join(ops) for ops in pages])
+
+    def _draw_lines(self, ops, lines, x, y):
+        for height, baseline, frags in lines:
+            for f in frags:
+                if f[0] == "T":
+                    _, fx, data, (font, size, (r, g, b), scale, spacing, _) = f
+                    ops.append(b"BT /%s %.2f Tf %.3f %.3f %.3f rg %.1f Tz %.2f Tc 1 0 0 1 %.2f %.2f Tm %s Tj ET\n" % (
+                        FONT_RESOURCES[font], size, r, g, b, scale * 100, spacing, x + fx, y - baseline,
+                        _pdf_string(data)))
+                else:
+                    _, fx, w, h, name = f
+                    ops.append(b"q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q\n" % (w, h, x + fx, y - baseline, name))
+            y -= height
+
+    def _draw_table(self, table, replacements, left, y, bottom, pages, new_page):
+        x0 = left - table.margin
+        col_x = [x0]
+        for w in table.columns:
+            col_x.append(col_x[-1] + w)
+        # lay out every cell, then size rows; a vertically merged cell that
+        # needs more room than its rows have stretches the last of them
+        laid = []
+        heights = []
+        for row in table.rows:
+            cells = []
+            content = 0.0
+            for cell in row.cells:
+                paras = [p.lines or layout_paragraph(p, p.items_for(replacements), cell.width) for p in cell.paras]
+                needed = sum(h for _, h in paras)
+                cells.append((cell, paras, needed))
+                if cell.vmerge is None:
+                    content = max(content, needed)
+            laid.append(cells)
+            heights.append(row.height if row.exact else max(row.height, content))
+        merges = {}     # (row, col) of a restart cell -> last row it spans
+        for ri, cells in enumerate(laid):
+            for cell, _, _ in cells:
+                if cell.vmerge == "restart":
+                    last = ri
+                    while last + 1 < len(laid) and any(c.col == cell.col and c.vmerge == "continue"
+                                                       for c, _, _ in laid[last + 1]):
+                        last += 1
+                    merges[(ri, cell.col)] = last
+        for (ri, _), last in merges.items():
+            for cell, _, needed in laid[ri]:
+                if cell.vmerge == "restart" and merges.get((ri, cell.col)) == last:
+                    extra = needed - sum(heights[ri:last + 1])
+                    if extra > 0 and not table.rows[last].exact:
+                        heights[last] += extra
+
+        borders = {}    # line width -> [(x1, y1, x2, y2)]
+        for ri, cells in enumerate(laid):
+            if ri and y - heights[ri] < bottom:
+                # rows move to the next page whole
+                self._stroke(pages[-1], borders)
+                borders = {}
+                y = new_page()
+            ops = pages[-1]
+            for cell, paras, _ in cells:
+                if cell.vmerge == "continue":
+                    continue
+                last = merges.get((ri, cell.col), ri)
+                bottom_y = y - sum(heights[ri:last + 1])
+                x1, x2 = col_x[cell.col], col_x[cell.col + cell.span]
+                top_w, left_w, bottom_w, right_w = cell.borders
+                if last != ri:
+                    # a merged cell's bottom border is the one of its last row
+                    for c, _, _ in laid[last]:
+                        if c.col == cell.col:
+                            bottom_w = c.borders[2]
+                for w, line in ((top_w, (x1, y, x2, y)), (bottom_w, (x1, bottom_y, x2, bottom_y)),
+                                (left_w, (x1, y, x1, bottom_y)), (right_w, (x2, y, x2, bottom_y))):
+                    if w:
+                        borders.setdefault(w, []).append(line)
+                py = y
+                for lines, height in paras:
+                    self._draw_lines(ops, lines, x1 + table.margin, py)
+                    py -= height
+            y -= heights[ri]
+        self._stroke(pages[-1], borders)
+        return y
+
+    @staticmethod
+    def _stroke(ops, borders):
+        for w, lines in borders.items():
+            ops.append(b"%.2f w 0 0 0 RG\n" % w)
+            ops.extend(b"%.2f %.2f m %.2f %.2f l S\n" % line for line in lines)
+
+    def _document(self, contents):
+        # Objects: 1 catalog, 2 page tree, the static fonts/images, then a
+        # page and a content stream per page.
+        first = 3 + len(self.static_objects)
+        page_ids = [first + 2 * i for i in range(len(contents))]
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % i for i in page_ids), len(contents)),
+        ]
+        objects.extend(self.static_objects)
+        for page_id, content in zip(page_ids, contents):
+            objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Resources %s /Contents %d 0 R >>" % (
+                self.page_size[0], self.page_size[1], self.resources, page_id + 1))
+            data = zlib.compress(content, 6)
+            objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(data) + data + b"\nendstream")
+        out = [b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"]
+        offsets = []
+        pos = len(out[0])
+        for i, body in enumerate(objects, start=1):
+            chunk = b"%d 0 obj\n" % i + body + b"\nendobj\n"
+            offsets.append(pos)
+            out.append(chunk)
+            pos += len(chunk)
+        out.append(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        out.extend(b"%010d 00000 n \n" % off for off in offsets)
+        out.append(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, pos))
+        return b"".join(out)
+
+def compile_pdf_layout(doc):
+    # Reads only the main document part of `doc`; headers and footers are
+    # not drawn.
+    compiler = _Compiler(doc)
+    body = doc.element.body
+    sect = body.find(_w("sectPr"))
+    pg_sz = sect.find(_w("pgSz")) if sect is not None else None
+    pg_mar = sect.find(_w("pgMar")) if sect is not None else None
+    page_size = (int(pg_sz.get(_w("w"), "11906")) * TWIP, int(pg_sz.get(_w("h"), "16838")) * TWIP) \
+        if pg_sz is not None else (595.3, 841.9)
+    margins = tuple(int(pg_mar.get(_w(side), "1440")) * TWIP for side in ("top", "right", "bottom", "left")) \
+        if pg_mar is not None else (72.0, 72.0, 72.0, 72.0)
+
+    width = page_size[0] - margins[1] - margins[3]
+    blocks = []
+    for el in body:
+        if el.tag == W_P:
+            para = compiler.paragraph(el, compiler.default_spacing)
+            if para.slot is None:
+                para.lines = layout_paragraph(para, para.items, width)
+            blocks.append(para)
+        elif el.tag == W_TBL:
+            blocks.append(compiler.table(el))
+    # like remove_trailing_empty_paragraphs
+    while blocks and isinstance(blocks[-1], Para) and blocks[-1].slot is None and \
+            not any(i[0] == "img" or i[1].strip() for i in blocks[-1].items):
+        blocks.pop()
+
+    static_objects = []
+    fonts = []
+    for name, resource in FONT_RESOURCES.items():
+        static_objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % name.encode())
+        fonts.append(b"/%s %d 0 R" % (resource, 2 + len(static_objects)))
+    images = []
+    for resource, body_bytes in compiler.images.values():
+        static_objects.append(body_bytes)
+        images.append(b"/%s %d 0 R" % (resource, 2 + len(static_objects)))
+    resources = b"<< /Font << %s >> /XObject << %s >> >>" % (b" ".join(fonts), b" ".join(images))
+    return PdfLayout(page_size, margins, blocks, static_objects, resources)
@@ -0,0 +1,117 @@
+# profiling.py
+# Profiles single requests on demand. Each profiled request leaves three
+# files in the profiles directory:
+#   <id>.pstats     cProfile data (python -m pstats, snakeviz, ...)
+#   <id>.txt        the top functions by cumulative time
+#   <id>.collapsed  stacks sampled every `interval` seconds while cProfile
+#                   ran, one "outer;...;inner count" line per stack, for
+#                   flamegraph.pl / speedscope. The sampled times include
+#                   cProfile's own overhead, the proportions are what matter.
+# Only one request is profiled at a time; cProfile cannot nest and a busy
+# server would otherwise profile itself.
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ID_RE = re.compile(r"^[\w.-]+$")
+KINDS = {"pstats": "application/octet-stream", "txt": "text/plain", "collapsed": "text/plain"}
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class _Sampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+class _Session:
+    def __init__(self, interval):
+        self.profile = cProfile.Profile()
+        self.sampler = _Sampler(threading.get_ident(), interval)
+        self.started = time.time()
+
+class RequestProfiler:
+    def __init__(self, directory, keep=50, interval=0.001):
+        self.directory = directory
+        self.keep = keep
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    def start(self):
+        # -> a session to pass to finish(), or None when another request is
+        # being profiled
+        if not self._busy.acquire(blocking=False):
+            return None
+        session = _Session(self.interval)
+        session.sampler.start()
+        session.profile.enable()
+        return session
+
+    def finish(self, session, label):
+        # Stops profiling and writes the files. -> profile id
+        try:
+            session.profile.disable()
+            session.sampler.stop()
+        finally:
+            self._busy.release()
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(session.started))
+        label = re.sub(r"[^\w-]", "_", label)
+        profile_id = f"{stamp}-{label}-{secrets.token_hex(3)}"
+        base = os.path.join(self.directory, profile_id)
+        session.profile.dump_stats(base + ".pstats")
+        out = io.StringIO()
+        pstats.Stats(session.profile, stream=out).sort_stats("cumulative").print_stats(40)
+        with open(base + ".txt", "w") as fh:
+            fh.write(out.getvalue())
+        with open(base + ".collapsed", "w") as fh:
+            for stack, count in session.sampler.stacks.most_common():
+                fh.write(f"{stack} {count}\n")
+        self._prune()
+        logger.info("Profiled %s -> %s", label, base)
+        return profile_id
+
+    def _prune(self):
+        # Keep the newest `keep` profiles
+        ids = sorted({name.rsplit(".", 1)[0] for name in os.listdir(self.directory)
+                      if name.rsplit(".", 1)[-1] in KINDS})
+        for old in ids[:-self.keep] if len(ids) > self.keep else []:
+            for kind in KINDS:
+                try:
+                    os.remove(os.path.join(self.directory, f"{old}.{kind}"))
+                except FileNotFoundError:
+                    pass
+
+    def path(self, profile_id, kind):
+        # Path of a stored profile file, or None
+        if kind not in KINDS or not PROFILE_ID_RE.match(profile_id):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.{kind}")
+        return path if os.path.exists(path) else None
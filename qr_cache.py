@@ -0,0 +1,57 @@
+# qr_cache.py
+# Rendered setup QR codes, one per provisioning URI and format, so reloading
+# the 2FA setup page does not run qrcode's matrix layout and PNG encoding
+# again. Entries expire after `ttl` seconds (a setup is abandoned long
+# before that) and are dropped as soon as the setup completes; at most
+# `max_entries` are kept.
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+MIMETYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+def render_qr(uri, fmt):
+    import qrcode
+    buf = BytesIO()
+    if fmt == "svg":
+        # drawn as one SVG path through xml.etree, no PIL image or PNG encoding
+        from qrcode.image.svg import SvgPathImage
+        qrcode.make(uri, image_factory=SvgPathImage).save(buf)
+    else:
+        qrcode.make(uri).save(buf, format="PNG")
+    return buf.getvalue()
+
+def _key(uri):
+    return hashlib.sha256(uri.encode("utf-8")).hexdigest()
+
+class QrCache:
+    def __init__(self, max_entries=32, ttl=15 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (key, fmt) -> (expires, data, etag)
+
+    def get(self, uri, fmt):
+        # -> (image bytes, etag)
+        key = (_key(uri), fmt)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1], entry[2]
+        data = render_qr(uri, fmt)
+        etag = hashlib.sha256(data).hexdigest()[:32]
+        with self._lock:
+            self._entries[key] = (now + self.ttl, data, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return data, etag
+
+    def discard(self, uri):
+        with self._lock:
+            for fmt in MIMETYPES:
+                self._entries.pop((_key(uri), fmt), None)
@@ -0,0 +1,107 @@
+# render_cache.py
+# Content-addressed cache of rendered invoices (DOCX or PDF bytes) on disk.
+# The key is a hash of the output kind, the template version and the full
+# replacements dict, so regenerating an identical invoice is a file read.
+# Entries are evicted least-recently-used first (by mtime, refreshed on every
+# hit) once the directory grows past max_bytes; processes sharing the
+# directory share the cache.
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".bin"
+
+class RenderCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk as last counted, plus our writes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(kind, template_version, replacements):
+        h = hashlib.sha256()
+        h.update(f"{kind}\0{template_version}\0".encode("utf-8"))
+        h.update(json.dumps(replacements, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            os.utime(path)  # most recently used
+        except FileNotFoundError:
+            self.misses += 1
+            METRICS.inc("render_cache_requests_total", result="miss")
+            return None
+        self.hits += 1
+        METRICS.inc("render_cache_requests_total", result="hit")
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def get_or_render(self, key, render):
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(SUFFIX):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue  # evicted by another process
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # Down to 90% of the limit, so a full cache does not rescan the
+        # directory on every write.
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self._size = total
+        logger.info("Render cache: evicted %d entries, %d bytes left", removed, total)
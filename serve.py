@@ -0,0 +1,75 @@
+# serve.py
+# Production entry point: the app under gunicorn's pre-fork server.
+#   python serve.py [--bind 0.0.0.0:80] [--workers N] [--threads N]
+# The master imports app.py (with APP_PRELOAD=1) and compiles the template
+# before forking, so every worker starts warm and shares those pages
+# copy-on-write. `python app.py` is still Flask's development server.
+# Each worker starts its own LibreOffice pool on its first conversion, so
+# size --workers x PDF_CONVERT_WORKERS soffice processes for the host.
+#
+# Graceful reload: `kill -HUP <master pid>` starts new workers and retires the
+# old ones once their requests finish. A changed uploads/template.docx needs
+# no reload (each worker's TemplateRegistry watcher thread picks it up); code
+# changes need a restart, since the code is loaded in the master.
+# `kill -TERM` shuts down gracefully.
+import argparse
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+def warm_up():
+    # Everything a first request would otherwise build, done in the master
+    import app
+    # check() parses and prepares the template without starting the
+    # registry's watcher thread; each worker starts its own after the fork.
+    app.TEMPLATES.check()
+    active = [v["version"] for v in app.TEMPLATES.versions() if v["active"]]
+    logger.info("Preloaded template %s (%s)", app.UPLOAD_TEMPLATE, active[0][:12] if active else "none")
+
+def load_app():
+    # Imported once in the master, so a generated APP_SECRET is shared by
+    # all workers (and survives a HUP, not a restart)
+    os.environ.setdefault("APP_PRELOAD", "1")
+    from app import app as flask_app
+    warm_up()
+    return flask_app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the invoice app with gunicorn")
+    parser.add_argument("--bind", default=os.environ.get("BIND", "0.0.0.0:80"))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1)),
+                        help="worker processes")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("WEB_THREADS", 4)),
+                        help="threads per worker; requests mostly wait on disk and renders")
+    parser.add_argument("--timeout", type=int, default=int(os.environ.get("WEB_TIMEOUT", 120)),
+                        help="seconds before a stuck worker is killed and replaced")
+    parser.add_argument("--max-requests", type=int, default=int(os.environ.get("WEB_MAX_REQUESTS", 0)),
+                        help="recycle a worker after this many requests (0: never)")
+    args = parser.parse_args()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("serve.py needs gunicorn (pip install gunicorn)")
+
+    class InvoiceServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", [args.bind])
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("threads", args.threads)
+            self.cfg.set("timeout", args.timeout)
+            self.cfg.set("graceful_timeout", args.timeout)
+            self.cfg.set("max_requests", args.max_requests)
+            self.cfg.set("max_requests_jitter", args.max_requests // 10)
+            self.cfg.set("preload_app", True)
+            self.cfg.set("accesslog", os.environ.get("WEB_ACCESS_LOG"))
+
+        def load(self):
+            return load_app()
+
+    InvoiceServer().run()
+
+if __name__ == "__main__":
+    main()
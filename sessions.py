@@ -0,0 +1,165 @@
+# sessions.py
+# Server-side Flask sessions. The cookie only carries a signed random id;
+# the session itself lives in a store every worker (and, with Redis, every
+# node) reads, so a login made on one process is seen by all of them. The
+# store also hands out the secret the ids are signed with, created once by
+# whichever process asks first.
+#   SqliteSessionStore  one host, any number of worker processes
+#   RedisSessionStore   several hosts; takes a redis-py compatible client
+import secrets
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id      TEXT PRIMARY KEY,
+    data    TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# expired rows are deleted on roughly one save in this many
+PURGE_EVERY = 200
+
+class SqliteSessionStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def load(self, sid):
+        with self._connect() as conn:
+            row = conn.execute("SELECT data FROM sessions WHERE id = ? AND expires > ?",
+                               (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def save(self, sid, data, ttl):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (sid, data, now + ttl))
+            if secrets.randbelow(PURGE_EVERY) == 0:
+                conn.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def delete(self, sid):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def shared_secret(self):
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('secret', ?)", (secrets.token_hex(32),))
+            return conn.execute("SELECT value FROM meta WHERE key = 'secret'").fetchone()[0]
+
+class RedisSessionStore:
+    def __init__(self, client, prefix="invoice:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, prefix="invoice:"):
+        import redis
+        return cls(redis.Redis.from_url(url), prefix)
+
+    def _key(self, sid):
+        return f"{self.prefix}session:{sid}"
+
+    def load(self, sid):
+        data = self.client.get(self._key(sid))
+        return data.decode("utf-8") if isinstance(data, bytes) else data
+
+    def save(self, sid, data, ttl):
+        self.client.set(self._key(sid), data, ex=max(1, int(ttl)))
+
+    def delete(self, sid):
+        self.client.delete(self._key(sid))
+
+    def shared_secret(self):
+        key = f"{self.prefix}secret"
+        self.client.set(key, secrets.token_hex(32), nx=True)
+        value = self.client.get(key)
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+class ServerSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="invoice-session")
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie and app.secret_key:
+            try:
+                sid = self._signer(app).unsign(cookie).decode("ascii")
+            except BadSignature:
+                sid = None
+            # a forged or stale cookie costs no store lookup
+            if sid:
+                data = self.store.load(sid)
+                if data is not None:
+                    return ServerSession(self.serializer.loads(data), sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        ttl = app.permanent_session_lifetime.total_seconds()
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), ttl)
+        response.vary.add("Cookie")
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid.encode("ascii")).decode("ascii"),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def regenerate(self, session):
+        # New id for the same data, e.g. after login, so an id planted
+        # before authentication is worthless afterwards
+        if not session.new:
+            self.store.delete(session.sid)
+        session.sid = secrets.token_urlsafe(32)
+        session.modified = True
@@ -0,0 +1,188 @@
+# suffix_allocator.py
+# Per-month invoice suffix counters in SQLite, replacing the directory scan
+# in get_next_suffix_for_month. Each month keeps the highest committed suffix;
+# numbers in flight are held as reservations with an expiry, so two requests
+# can never be handed (or generate) the same GB-MMYY-NN at the same time.
+# A number only offered on an open form is a soft hold: other forms are
+# offered different numbers, but an explicit submit of it takes it over.
+# Expired reservations are handed out again.
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from invoice_registry import INVOICE_NO_RE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS suffix_counters (
+    month_year    TEXT PRIMARY KEY,
+    committed_max INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS suffix_reservations (
+    month_year TEXT NOT NULL,
+    suffix     INTEGER NOT NULL,
+    holder     TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    soft       INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (month_year, suffix)
+);
+CREATE INDEX IF NOT EXISTS suffix_reservations_holder ON suffix_reservations (holder, month_year);
+"""
+
+DEFAULT_TTL = 15 * 60
+
+class SuffixTaken(Exception):
+    def __init__(self, month_year, suffix, next_suffix):
+        super().__init__(f"GB-{month_year}-{suffix:02d} is being generated by another request")
+        self.month_year = month_year
+        self.suffix = suffix
+        self.next_suffix = next_suffix
+
+class SuffixAllocator:
+    def __init__(self, db_path, ttl=DEFAULT_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.executescript(SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(suffix_reservations)")]
+            if "soft" not in columns:
+                conn.execute("ALTER TABLE suffix_reservations ADD COLUMN soft INTEGER NOT NULL DEFAULT 0")
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, which serialises
+        # allocations across threads and worker processes.
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _read(self):
+        # Plain connection for lookups that take no write lock
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _committed_max(self, conn, month_year):
+        row = conn.execute("SELECT committed_max FROM suffix_counters WHERE month_year = ?",
+                           (month_year,)).fetchone()
+        return row[0] if row else 0
+
+    def _next_free(self, conn, month_year, now):
+        n = self._committed_max(conn, month_year) + 1
+        held = {s for (s,) in conn.execute(
+            "SELECT suffix FROM suffix_reservations WHERE month_year = ? AND suffix >= ? AND expires_at > ?",
+            (month_year, n, now))}
+        while n in held:
+            n += 1
+        return n
+
+    def _expire(self, conn, now):
+        conn.execute("DELETE FROM suffix_reservations WHERE expires_at <= ?", (now,))
+
+    # ---------- Allocation ----------
+    def suggest(self, month_year):
+        # Next free suffix without reserving it.
+        with self._read() as conn:
+            return self._next_free(conn, month_year, time.time())
+
+    def _current_hold(self, conn, month_year, holder):
+        row = conn.execute(
+            "SELECT suffix, expires_at FROM suffix_reservations WHERE holder = ? AND month_year = ? "
+            "ORDER BY suffix LIMIT 1", (holder, month_year)).fetchone()
+        if row and row[0] > self._committed_max(conn, month_year):
+            return row
+        return None
+
+    def hold(self, month_year, holder):
+        # The suffix `holder` (e.g. a browser session) is offered for the
+        # month; the same one is returned, with a fresh expiry, until it is
+        # committed, expires or is taken over by a submit. Other holders are
+        # offered different numbers. A hold with more than half its ttl left
+        # is returned from a read, so page views do not each take the write lock.
+        now = time.time()
+        with self._read() as conn:
+            row = self._current_hold(conn, month_year, holder)
+        if row and row[1] > now + self.ttl / 2:
+            return row[0]
+        with self._transaction() as conn:
+            self._expire(conn, now)
+            row = self._current_hold(conn, month_year, holder)
+            suffix = row[0] if row else self._next_free(conn, month_year, now)
+            # A held number that is being generated stays a hard reservation
+            conn.execute(
+                "INSERT INTO suffix_reservations VALUES (?, ?, ?, ?, 1) ON CONFLICT(month_year, suffix) "
+                "DO UPDATE SET expires_at = excluded.expires_at",
+                (month_year, suffix, holder, now + self.ttl))
+            return suffix
+
+    def reserve(self, month_year, holder, suffix=None):
+        # Reserve `suffix` (or the next free one) for `holder` while it is
+        # being generated. Takes over another holder's soft hold; raises
+        # SuffixTaken if another request is generating it.
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire(conn, now)
+            if suffix is None:
+                suffix = self._next_free(conn, month_year, now)
+            else:
+                row = conn.execute(
+                    "SELECT holder, soft FROM suffix_reservations WHERE month_year = ? AND suffix = ?",
+                    (month_year, suffix)).fetchone()
+                if row and row[0] != holder and not row[1]:
+                    raise SuffixTaken(month_year, suffix, self._next_free(conn, month_year, now))
+            conn.execute("INSERT OR REPLACE INTO suffix_reservations VALUES (?, ?, ?, ?, 0)",
+                         (month_year, suffix, holder, now + self.ttl))
+            return suffix
+
+    def commit(self, month_year, suffix):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM suffix_reservations WHERE month_year = ? AND suffix = ?",
+                         (month_year, suffix))
+            conn.execute(
+                "INSERT INTO suffix_counters VALUES (?, ?) ON CONFLICT(month_year) "
+                "DO UPDATE SET committed_max = MAX(committed_max, excluded.committed_max)",
+                (month_year, suffix))
+
+    def release(self, month_year, suffix, holder):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM suffix_reservations WHERE month_year = ? AND suffix = ? AND holder = ?",
+                         (month_year, suffix, holder))
+
+    def release_holder(self, holder):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM suffix_reservations WHERE holder = ?", (holder,))
+
+    # ---------- Rebuild ----------
+    def rebuild_from_filenames(self, names):
+        # Raise each month's counter to the highest GB-MMYY-NN found in
+        # `names`. Counters never go down, so it is safe to run at any time.
+        highest = {}
+        for name in names:
+            for m in INVOICE_NO_RE.finditer(name):
+                month_year, suffix = m.group(2), int(m.group(3))
+                if suffix > highest.get(month_year, 0):
+                    highest[month_year] = suffix
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO suffix_counters VALUES (?, ?) ON CONFLICT(month_year) "
+                "DO UPDATE SET committed_max = MAX(committed_max, excluded.committed_max)",
+                highest.items())
+        return highest
+
+    def rebuild_from_directory(self, path):
+        return self.rebuild_from_filenames(os.listdir(path))
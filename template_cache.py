@@ -0,0 +1,98 @@
+# template_cache.py
+import copy
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+
+from docx_render import build_stencil, compile_template
+from pdf_render import compile_pdf_layout
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateCache:
+    # Parses a .docx template once and hands out deep copies of the pristine
+    # master. The master is re-parsed only when the file on disk changes
+    # (mtime/size first, content hash to confirm). With watch=False the file
+    # is treated as immutable and never stat'ed again once loaded.
+
+    def __init__(self, path, watch=True):
+        self.path = path
+        self.watch = watch
+        self._lock = threading.Lock()
+        self._stat_key = None
+        self._digest = None
+        self._master = None
+        self._compiled = None
+        self._stencil = None
+        self._pdf_layout = None
+
+    def _stat(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        if self._master is not None and not self.watch:
+            return
+        stat_key = self._stat()
+        if self._master is not None and stat_key == self._stat_key:
+            return
+        with open(self.path, "rb") as fh:
+            data = fh.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if self._master is not None and digest == self._digest:
+            # touched but unchanged
+            self._stat_key = stat_key
+            return
+        from docx import Document
+        master = Document(BytesIO(data))
+        self._compiled = compile_template(master)
+        # compile_template walks master.paragraphs, which leaves python-docx
+        # wrappers cached around *sub*elements; deepcopy would give those
+        # detached copies of <w:body>. Round-trip once to get a clean master.
+        buf = BytesIO()
+        master.save(buf)
+        buf.seek(0)
+        master = Document(buf)
+        self._master = master
+        self._stencil = None
+        self._pdf_layout = None
+        self._digest = digest
+        self._stat_key = stat_key
+        logger.info("Loaded template %s (sha256 %s)", self.path, digest[:12])
+
+    @property
+    def version(self):
+        with self._lock:
+            self._refresh()
+            return self._digest
+
+    def snapshot(self):
+        # (master, compiled) for the same template version. The master is
+        # shared: only ever deepcopy it, never read or mutate it in place.
+        with self._lock:
+            self._refresh()
+            return self._master, self._compiled
+
+    def get(self):
+        # Copy outside the lock; the master itself is never mutated.
+        master, compiled = self.snapshot()
+        return copy.deepcopy(master), compiled
+
+    def stencil(self):
+        # Raw-XML renderer for the current version, built on first use.
+        with self._lock:
+            self._refresh()
+            if self._stencil is None:
+                self._stencil = build_stencil(copy.deepcopy(self._master), self._compiled)
+            return self._stencil
+
+    def pdf_layout(self):
+        # Native PDF renderer for the current version, built on first use.
+        with self._lock:
+            self._refresh()
+            if self._pdf_layout is None:
+                self._pdf_layout = compile_pdf_layout(copy.deepcopy(self._master))
+            return self._pdf_layout
@@ -0,0 +1,211 @@
+# template_registry.py
+# Every version of the invoice template, by content hash. A watcher thread
+# polls the template file; a new version is copied to versions_dir, parsed,
+# compiled and checked against the placeholders the app fills in, all off
+# the request path, and only then made active. The first version is loaded
+# by the first active() call (or an explicit check()), not on construction,
+# so importing the app does not pull in python-docx. Older versions stay on disk
+# and can be loaded again by hash, so an invoice can be re-rendered
+# byte-identically with the template it was first made from; which version
+# that was is recorded per invoice number.
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from template_cache import TemplateCache
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoice_templates (
+    invoice_no TEXT PRIMARY KEY,
+    version    TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+class TemplateRegistry:
+    def __init__(self, path, versions_dir, db_path, expected=(), poll_interval=2.0, keep=8, warm=None):
+        # `expected`: the placeholders the app provides values for.
+        # `warm(cache)`: extra per-version preparation (stencil, PDF layout).
+        # At most `keep` versions stay parsed in memory besides the active one.
+        self.path = path
+        self.versions_dir = versions_dir
+        self.db_path = db_path
+        self.expected = set(expected)
+        self.poll_interval = poll_interval
+        self.keep = keep
+        self.warm = warm
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._loaded = OrderedDict()  # version -> TemplateCache, LRU order
+        self._info = {}               # version -> validation details
+        self._active = None
+        self._stat_key = None
+        self._watcher_pid = None
+        os.makedirs(versions_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _version_path(self, version):
+        return os.path.join(self.versions_dir, f"{version}.docx")
+
+    # ---------- Loading ----------
+    def _load(self, version):
+        # Parse, compile and check one stored version. -> TemplateCache
+        cache = TemplateCache(self._version_path(version), watch=False)
+        _, compiled = cache.snapshot()
+        if self.warm is not None:
+            self.warm(cache)
+        placeholders = set(compiled.placeholders)
+        info = {
+            "version": version,
+            "placeholders": sorted(placeholders),
+            "unfilled": sorted(placeholders - self.expected),  # would print as {{name}}
+            "unused": sorted(self.expected - placeholders),
+            "loaded_at": time.time(),
+        }
+        if info["unfilled"]:
+            logger.warning("Template %s has placeholders without values: %s", version[:12], info["unfilled"])
+        with self._lock:
+            self._loaded[version] = cache
+            self._info[version] = info
+        return cache
+
+    def check(self):
+        # Makes a changed template file the active version. Never raises: a
+        # template that cannot be parsed is logged and the old one stays.
+        with self._check_lock:
+            self._check()
+
+    def _check(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        stat_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stat_key == self._stat_key:
+            return
+        try:
+            with open(self.path, "rb") as fh:
+                data = fh.read()
+            version = hashlib.sha256(data).hexdigest()
+            if self._active is None or version != self._active.version:
+                with self._lock:
+                    cache = self._loaded.get(version)
+                if cache is None:
+                    cache = self._store_and_load(version, data)
+                with self._lock:
+                    self._active = cache
+                    self._prune()
+                logger.info("Active template is now %s", version[:12])
+        except Exception as e:
+            logger.error("Template %s not activated: %s", self.path, e)
+        self._stat_key = stat_key
+
+    def _store_and_load(self, version, data):
+        # Only versions that load are kept in versions_dir (and listed)
+        stored = self._version_path(version)
+        if not os.path.exists(stored):
+            with open(stored + ".tmp", "wb") as fh:
+                fh.write(data)
+            os.replace(stored + ".tmp", stored)
+        try:
+            return self._load(version)
+        except Exception:
+            os.remove(stored)
+            raise
+
+    def _prune(self):
+        # Caller holds self._lock
+        while len(self._loaded) > self.keep + 1:
+            version = next(v for v in self._loaded if self._loaded[v] is not self._active)
+            del self._loaded[version]
+            self._info.pop(version, None)
+
+    # ---------- Watching ----------
+    def _ensure_watcher(self):
+        # One polling thread per process, started after a pre-fork server forks
+        if self.poll_interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, name="template-watcher", daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.check()
+
+    # ---------- Lookups ----------
+    def active(self):
+        # -> TemplateCache of the active version, already parsed
+        if self._active is None:
+            self.check()
+        self._ensure_watcher()
+        cache = self._active
+        if cache is None:
+            raise LookupError(f"No template loaded from {self.path}")
+        return cache
+
+    def get(self, version):
+        # -> TemplateCache for a stored version, or None
+        with self._lock:
+            cache = self._loaded.get(version)
+            if cache is not None:
+                self._loaded.move_to_end(version)
+                return cache
+        if len(version) != 64 or not all(c in "0123456789abcdef" for c in version) \
+                or not os.path.exists(self._version_path(version)):
+            return None
+        cache = self._load(version)
+        with self._lock:
+            self._prune()
+        return cache
+
+    def versions(self):
+        # Stored versions, newest first, with their check results if loaded
+        entries = []
+        with self._lock:
+            loaded_info = dict(self._info)
+            active = self._active.version if self._active is not None else None
+        for name in os.listdir(self.versions_dir):
+            if not name.endswith(".docx"):
+                continue
+            version = name[:-len(".docx")]
+            info = dict(loaded_info.get(version, {"version": version}))
+            info["active"] = version == active
+            info["stored_at"] = os.stat(os.path.join(self.versions_dir, name)).st_mtime
+            entries.append(info)
+        return sorted(entries, key=lambda e: e["stored_at"], reverse=True)
+
+    # ---------- Which invoice used which version ----------
+    def record(self, invoice_no, version):
+        # The first version stays: regenerating an invoice with a newer
+        # template does not change what "original" refers to
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO invoice_templates VALUES (?, ?, ?)",
+                         (invoice_no, version, time.time()))
+
+    def version_for(self, invoice_no):
+        with self._connect() as conn:
+            row = conn.execute("SELECT version FROM invoice_templates WHERE invoice_no = ?",
+                               (invoice_no,)).fetchone()
+        return row[0] if row else None
@@ -0,0 +1,152 @@
+# totp_guard.py
+# Replay protection and brute-force limiting for TOTP codes, shared by every
+# worker process on the host without a database: state is small files in a
+# directory, on tmpfs (/dev/shm) when there is one.
+#   used-<step>-<key>-<code>        an accepted code, created with O_EXCL so
+#                                   exactly one process can accept it
+#   fail-<bucket>-<client|all>      one byte appended per failed attempt;
+#                                   the file size is the count ("all" only
+#                                   with a global limit)
+# Both are named after their time step / bucket, so expiry is deleting the
+# old ones. Each process also remembers the codes it has seen accepted,
+# which turns a repeated code into a set lookup before any file access.
+import hashlib
+import hmac
+import os
+import tempfile
+import threading
+import time
+
+OK, INVALID, REPLAYED, RATE_LIMITED = "ok", "invalid", "replayed", "rate_limited"
+
+def default_state_dir():
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"invoice-totp-{os.getuid()}")
+
+def _digest(value, length=12):
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:length]
+
+class TotpGuard:
+    def __init__(self, state_dir=None, valid_window=1, max_failures=5, max_failures_total=0, lockout=300):
+        # At most `max_failures` failed codes per client, and with
+        # `max_failures_total` > 0 also that many overall, per `lockout`
+        # seconds. The global limit is off by default: anyone can use it up
+        # and lock every user out.
+        self.state_dir = state_dir or default_state_dir()
+        self.valid_window = valid_window
+        self.max_failures = max_failures
+        self.max_failures_total = max_failures_total
+        self.lockout = lockout
+        self._lock = threading.Lock()
+        self._codes = {}     # (secret key, step) -> expected code
+        self._used = set()   # used-* names accepted or seen taken
+        self._cleaned_at = 0.0
+        os.makedirs(self.state_dir, mode=0o700, exist_ok=True)
+
+    # ---------- Codes ----------
+    def _expected(self, totp, key, step):
+        with self._lock:
+            code = self._codes.get((key, step))
+        if code is None:
+            code = totp.generate_otp(step)
+            with self._lock:
+                self._codes[(key, step)] = code
+        return code
+
+    def _matching_step(self, totp, key, code, now):
+        # HMACs are computed once per secret and time step, not per attempt
+        current = int(now // totp.interval)
+        for step in range(current - self.valid_window, current + self.valid_window + 1):
+            if hmac.compare_digest(self._expected(totp, key, step), code):
+                return step
+        return None
+
+    def _claim(self, key, step, code):
+        name = f"used-{step}-{key}-{code}"
+        if name in self._used:
+            return False
+        try:
+            os.close(os.open(os.path.join(self.state_dir, name), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        except FileExistsError:
+            return False
+        finally:
+            with self._lock:
+                self._used.add(name)
+        return True
+
+    # ---------- Failures ----------
+    def _fail_paths(self, client, now):
+        bucket = int(now // self.lockout)
+        who_failed = [_digest(client or "-")]
+        if self.max_failures_total > 0:
+            who_failed.append("all")
+        for who in who_failed:
+            yield [os.path.join(self.state_dir, f"fail-{b}-{who}") for b in (bucket, bucket - 1)]
+
+    def failures(self, client, now=None):
+        # -> (this client's, everyone's) failures in the current and previous
+        # lockout buckets; everyone's is 0 without a global limit
+        counts = []
+        for paths in self._fail_paths(client, now or time.time()):
+            total = 0
+            for path in paths:
+                try:
+                    total += os.stat(path).st_size
+                except FileNotFoundError:
+                    pass
+            counts.append(total)
+        if len(counts) == 1:
+            counts.append(0)
+        return tuple(counts)
+
+    def locked(self, client, now=None):
+        mine, everyone = self.failures(client, now)
+        return mine >= self.max_failures or 0 < self.max_failures_total <= everyone
+
+    def _record_failure(self, client, now):
+        for paths in self._fail_paths(client, now):
+            fd = os.open(paths[0], os.O_CREAT | os.O_APPEND | os.O_WRONLY, 0o600)
+            try:
+                os.write(fd, b"x")
+            finally:
+                os.close(fd)
+
+    # ---------- Expiry ----------
+    def _cleanup(self, interval, now):
+        if now - self._cleaned_at < interval:
+            return
+        self._cleaned_at = now
+        oldest_step = int(now // interval) - self.valid_window - 1
+        oldest_bucket = int(now // self.lockout) - 1
+        with self._lock:
+            self._codes = {k: v for k, v in self._codes.items() if k[1] >= oldest_step}
+            self._used = {n for n in self._used if int(n.split("-")[1]) >= oldest_step}
+        for name in os.listdir(self.state_dir):
+            kind, _, rest = name.partition("-")
+            try:
+                number = int(rest.split("-")[0])
+            except ValueError:
+                continue
+            if (kind == "used" and number < oldest_step) or (kind == "fail" and number < oldest_bucket):
+                try:
+                    os.remove(os.path.join(self.state_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def check(self, totp, code, client=None, now=None):
+        # -> OK, INVALID, REPLAYED or RATE_LIMITED for `code` against the
+        # pyotp.TOTP `totp`, on behalf of `client` (e.g. the remote address)
+        now = now or time.time()
+        self._cleanup(totp.interval, now)
+        if self.locked(client, now):
+            return RATE_LIMITED
+        code = str(code).strip()
+        key = _digest(totp.secret)
+        step = self._matching_step(totp, key, code, now) if len(code) == totp.digits and code.isdigit() else None
+        if step is None:
+            self._record_failure(client, now)
+            return INVALID
+        if not self._claim(key, step, code):
+            self._record_failure(client, now)
+            return REPLAYED
+        return OK
@@ -0,0 +1,83 @@
+# totp_store.py
+# The TOTP secret, read once and kept in memory with a ready-made verifier.
+# The file is re-read only when its (inode, mtime, size) changes, checked at
+# most every `check_interval` seconds, so a secret saved by another worker
+# (or replaced by hand) is picked up without a restart. Writes go to a
+# temporary file that is renamed over the old one, so readers in other
+# processes see either the old secret or the new one, never half of it.
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+class TotpSecretStore:
+    def __init__(self, path, check_interval=1.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._stat_key = None
+        self._secret = None
+        self._totp = None
+        self._checked_at = 0.0
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        stat_key = self._stat()
+        if stat_key == self._stat_key:
+            return
+        secret = None
+        if stat_key is not None:
+            try:
+                secret = self.path.read_text().strip() or None
+            except FileNotFoundError:
+                stat_key = None
+        if secret != self._secret:
+            self._secret = secret
+            self._totp = None
+        self._stat_key = stat_key
+
+    def get(self):
+        with self._lock:
+            self._refresh()
+            return self._secret
+
+    def verifier(self, secret=None):
+        # pyotp.TOTP for `secret`; the stored secret's is built once
+        import pyotp
+        with self._lock:
+            self._refresh()
+            if secret is None or secret == self._secret:
+                if self._secret is None:
+                    return None
+                if self._totp is None:
+                    self._totp = pyotp.TOTP(self._secret)
+                return self._totp
+        return pyotp.TOTP(secret)
+
+    def save(self, secret):
+        directory = self.path.parent
+        fd, tmp = tempfile.mkstemp(prefix=f".{self.path.name}.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as fh:
+                fh.write(secret)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            self._refresh(force=True)
@@ -1,4 +1,70 @@
-from num2words import num2words
+from functools import lru_cache
 
 def number_to_words(n):
+    from num2words import num2words
     return num2words(n, lang='en_IN').replace(",", "").title() + " Rupees Only"
+
+# ---------- Indian numbering (lakh/crore) without num2words ----------
+# Same wording as num2words(n, lang='en_IN').replace(",", "").title(), built
+# from precomputed 0-999 tables. Differential check: python bench.py --verify-words
+
+_ONES = [
+    "Zero", "One", "Two", "Three", "Four", "Five", "Six", "Seven", "Eight", "Nine",
+    "Ten", "Eleven", "Twelve", "Thirteen", "Fourteen", "Fifteen", "Sixteen",
+    "Seventeen", "Eighteen", "Nineteen",
+]
+_TENS = ["", "", "Twenty", "Thirty", "Forty", "Fifty", "Sixty", "Seventy", "Eighty", "Ninety"]
+
+def _below_thousand(n):
+    if n < 20:
+        return _ONES[n]
+    if n < 100:
+        tens, ones = divmod(n, 10)
+        return _TENS[tens] + ("-" + _ONES[ones] if ones else "")
+    hundreds, rest = divmod(n, 100)
+    words = _ONES[hundreds] + " Hundred"
+    return words + " And " + _below_thousand(rest) if rest else words
+
+WORDS_0_999 = tuple(_below_thousand(n) for n in range(1000))
+
+INDIAN_WORDS_MAX = 10 ** 10  # num2words' en_IN limit
+
+def indian_number_words(n):
+    # Integer -> "Twelve Lakh Thirty-Four Thousand Five Hundred And Sixty-Seven"
+    if n < 0:
+        return "Minus " + indian_number_words(-n)
+    if n >= INDIAN_WORDS_MAX:
+        raise OverflowError(f"abs({n}) must be less than {INDIAN_WORDS_MAX}.")
+    if n < 1000:
+        return WORDS_0_999[n]
+    crore, n = divmod(n, 10 ** 7)
+    lakh, n = divmod(n, 10 ** 5)
+    thousand, rest = divmod(n, 1000)
+    groups = []
+    if crore:
+        groups.append(WORDS_0_999[crore] + " Crore")
+    if lakh:
+        groups.append(WORDS_0_999[lakh] + " Lakh")
+    if thousand:
+        groups.append(WORDS_0_999[thousand] + " Thousand")
+    words = " ".join(groups)
+    if rest:
+        # a bare tens/ones remainder is joined with "And": "One Lakh And Five"
+        words += (" And " if rest < 100 else " ") + WORDS_0_999[rest]
+    return words
+
+@lru_cache(maxsize=4096)
+def _amount_words(amount_str):
+    rupees_str, paise_str = amount_str.split(".")
+    rupees = int(rupees_str)
+    paise = int(paise_str)
+    rupees_words = indian_number_words(rupees)
+    if paise > 0:
+        paise_words = WORDS_0_999[paise]
+        return f"{rupees_words} Rupees And {paise_words} Paise Only"
+    else:
+        return f"{rupees_words} Rupees Only"
+
+def number_to_words_indian(amount):
+    # Cached on the amount rounded to paise
+    return _amount_words("{:.2f}".format(float(amount)))
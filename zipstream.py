@@ -0,0 +1,123 @@
+# zipstream.py
+# Minimal streaming ZIP writer. Unlike zipfile.ZipFile it never needs a
+# seekable output: every method returns the bytes to send next, so callers
+# can write them to a file, join them, or yield them from a Flask response.
+# Entries can also be prepared (compressed + CRC'd) once and re-emitted many
+# times without recompressing. No ZIP64: archives are limited to 4 GiB.
+import struct
+import zlib
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+LOCAL_HEADER = struct.Struct("<4sHHHHHLLLHH")
+CENTRAL_HEADER = struct.Struct("<4sHHHHHHLLLHHHHHLL")
+END_OF_CENTRAL_DIR = struct.Struct("<4sHHHHLLH")
+DATA_DESCRIPTOR = struct.Struct("<4sLLL")
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION = 20
+MAX_SIZE = 0xFFFFFFFF
+
+# 1980-01-01 00:00:00, the same fixed stamp Word uses, so identical input
+# produces identical archives.
+DEFAULT_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+def dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = DEFAULT_DATE_TIME
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | (second // 2)
+    return dos_date, dos_time
+
+class PreparedEntry:
+    # A compressed entry that can be written into any number of archives.
+    __slots__ = ("name", "flags", "method", "crc", "compressed", "size", "dos_date", "dos_time")
+
+    def __init__(self, name, data, compress_type=ZIP_DEFLATED, compresslevel=6, date_time=DEFAULT_DATE_TIME):
+        self.name = name.encode("utf-8")
+        self.flags = 0 if name.isascii() else FLAG_UTF8
+        self.method = compress_type
+        self.crc = zlib.crc32(data)
+        self.size = len(data)
+        if compress_type == ZIP_DEFLATED:
+            co = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+            self.compressed = co.compress(data) + co.flush()
+        elif compress_type == ZIP_STORED:
+            self.compressed = bytes(data)
+        else:
+            raise ValueError(f"Unsupported compression type {compress_type}")
+        self.dos_date, self.dos_time = dos_date_time(date_time)
+
+class ZipStream:
+    def __init__(self):
+        self.offset = 0
+        self._central = []
+
+    def _check_size(self, *sizes):
+        for n in sizes:
+            if n > MAX_SIZE:
+                raise ValueError("ZIP64 archives are not supported")
+
+    def _record(self, name, flags, method, dos_date, dos_time, crc, csize, size, header_offset):
+        self._check_size(csize, size, header_offset)
+        self._central.append(CENTRAL_HEADER.pack(
+            b"PK\x01\x02", VERSION, VERSION, flags, method, dos_time, dos_date,
+            crc, csize, size, len(name), 0, 0, 0, 0, 0o600 << 16, header_offset,
+        ) + name)
+
+    def _emit(self, chunk):
+        self.offset += len(chunk)
+        return chunk
+
+    def write_prepared(self, entry):
+        header_offset = self.offset
+        self._record(entry.name, entry.flags, entry.method, entry.dos_date, entry.dos_time,
+                     entry.crc, len(entry.compressed), entry.size, header_offset)
+        header = LOCAL_HEADER.pack(
+            b"PK\x03\x04", VERSION, entry.flags, entry.method, entry.dos_time, entry.dos_date,
+            entry.crc, len(entry.compressed), entry.size, len(entry.name), 0,
+        ) + entry.name
+        return self._emit(header + entry.compressed)
+
+    def write_bytes(self, name, data, compress_type=ZIP_DEFLATED, compresslevel=6, date_time=DEFAULT_DATE_TIME):
+        return self.write_prepared(PreparedEntry(name, data, compress_type, compresslevel, date_time))
+
+    def write_stream(self, name, chunks, date_time=DEFAULT_DATE_TIME):
+        # Generator: stores `chunks` (an iterable of bytes) without
+        # compression, streaming them through as they arrive. CRC and sizes go
+        # into a trailing data descriptor, so nothing is buffered.
+        name_bytes = name.encode("utf-8")
+        flags = FLAG_DATA_DESCRIPTOR | (0 if name.isascii() else FLAG_UTF8)
+        dos_date, dos_time = dos_date_time(date_time)
+        header_offset = self.offset
+        yield self._emit(LOCAL_HEADER.pack(
+            b"PK\x03\x04", VERSION, flags, ZIP_STORED, dos_time, dos_date,
+            0, 0, 0, len(name_bytes), 0,
+        ) + name_bytes)
+        crc = 0
+        size = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            yield self._emit(chunk)
+        self._record(name_bytes, flags, ZIP_STORED, dos_date, dos_time, crc, size, size, header_offset)
+        yield self._emit(DATA_DESCRIPTOR.pack(b"PK\x07\x08", crc, size, size))
+
+    def close(self):
+        central = b"".join(self._central)
+        self._check_size(self.offset)
+        end = END_OF_CENTRAL_DIR.pack(
+            b"PK\x05\x06", 0, 0, len(self._central), len(self._central), len(central), self.offset, 0,
+        )
+        return self._emit(central + end)
+
+def iter_file(path, chunk_size=64 * 1024):
+    with open(path, "rb") as fh:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk